@@ -0,0 +1,106 @@
+#!/usr/local/bin/python3
+
+# ****
+# Lawrence Berkeley National Lab
+#
+# Benchmark of sympl_api_lowlevel.etreeToDict against the recursive
+# StackOverflow recipe it replaced. Builds synthetic Elements-style
+# feeds of increasing size, checks that both converters produce
+# exactly the same dicts, and reports how long each takes.
+#
+#   python3 bench_etree_to_dict.py [ entries entries ... ]
+# ****
+
+import sys
+import time
+import xml.etree.ElementTree as etree
+from collections import defaultdict
+import sympl_api_lowlevel as fapi
+
+
+# the converter as it was before, kept here as the reference
+def recipeEtreeToDict(t):
+    d = {t.tag: {} if t.attrib else None}
+    children = list(t)
+    if children:
+        dd = defaultdict(list)
+        for dc in map(recipeEtreeToDict, children):
+            for k, v in dc.items():
+                dd[k].append(v)
+        d = {t.tag: {k:v[0] if len(v) == 1 else v for k, v in dd.items()}}
+    if t.attrib:
+        d[t.tag].update(('@' + k, v) for k, v in t.attrib.items())
+    if t.text:
+        text = t.text.strip()
+        if children or t.attrib:
+            if text:
+              d[t.tag]['#text'] = text
+        else:
+            d[t.tag] = text
+    return d
+
+
+# one publication entry, roughly the shape of publications?detail=full,
+# with two source records and a mix of text, date, people and
+# pagination fields
+def makeEntry(i):
+    authors = ''.join([
+        '<person><last-name>Author{0}</last-name><initials>A</initials>'
+        '<first-names>Some</first-names></person>'.format(j)
+        for j in range(i % 5 + 1) ])
+    record = (
+        '<record format="native" id="{0}" source-id="{1}" source-name="source-{1}">'
+        '<native>'
+        '<field name="title" type="text" display-name="Title"><text>Title of paper {0}</text></field>'
+        '<field name="doi" type="text" display-name="DOI"><text>10.1000/bench.{0}</text></field>'
+        '<field name="journal" type="text" display-name="Journal"><text>Journal {2}</text></field>'
+        '<field name="volume" type="text" display-name="Volume"><text>{2}</text></field>'
+        '<field name="publication-date" type="date" display-name="Date">'
+        '<date><day>1</day><month>6</month><year>2017</year></date></field>'
+        '<field name="pagination" type="pagination" display-name="Pages">'
+        '<pagination><begin-page>{0}</begin-page><end-page>{3}</end-page></pagination></field>'
+        '<field name="authors" type="person-list" display-name="Authors"><people>{4}</people></field>'
+        '</native></record>')
+    records = ''.join([ record.format(i, s, i % 40, i + 9, authors) for s in (1, 3) ])
+    return (
+        '<entry><title>Title of paper {0}</title><id>tag:elements@{0}</id>'
+        '<updated>2017-06-05T12:00:00Z</updated>'
+        '<object category="publication" id="{0}" type="journal-article" '
+        'created-when="2017-06-05T12:00:00Z">'
+        '<ever-approved>true</ever-approved>'
+        '<records>{1}</records></object></entry>').format(i, records)
+
+
+def makeFeed(n):
+    pagination = (
+        '<pagination results-count="{0}" items-per-page="{0}">'
+        '<page position="first" number="1" href="x"/>'
+        '<page position="last" number="1" href="x"/></pagination>').format(n)
+    entries = ''.join([ makeEntry(i) for i in range(n) ])
+    return '<feed><title>Bench</title>{0}{1}</feed>'.format(pagination, entries)
+
+
+def timeIt(fn, arg, repeat):
+    best = None
+    for _ in range(repeat):
+        t0 = time.perf_counter()
+        fn(arg)
+        dt = time.perf_counter() - t0
+        if best is None or dt < best:
+            best = dt
+    return best
+
+
+if __name__ == '__main__':
+    sizes = [ int(a) for a in sys.argv[1:] ] or [ 10, 100, 1000, 5000 ]
+
+    print('{0:>8} {1:>12} {2:>12} {3:>8}'.format('entries', 'recipe ms', 'new ms', 'speedup'))
+    for n in sizes:
+        root = etree.fromstring(makeFeed(n))
+        if fapi.etreeToDict(root) != recipeEtreeToDict(root):
+            print('-err- outputs differ for {0} entries'.format(n))
+            sys.exit(1)
+        repeat = 5 if n <= 1000 else 2
+        old = timeIt(recipeEtreeToDict, root, repeat)
+        new = timeIt(fapi.etreeToDict, root, repeat)
+        print('{0:>8} {1:>12.1f} {2:>12.1f} {3:>7.2f}x'.format(n, old * 1000, new * 1000, old / new))
@@ -4,8 +4,11 @@
 
 import re
 import urllib.parse
+import concurrent.futures
 import sympl_api_highlevel
+import work_pool
 import debughelpers
+import result_writer
 import sys
 
 # I loathe parseargs, sorry:
@@ -27,6 +30,10 @@ def readArgs():
             i += 1
             arg = sys.argv[i]
             args['jsoutfile'] = arg
+        elif re.match(r'-of',arg):
+            i += 1
+            arg = sys.argv[i]
+            args['outformat'] = result_writer.parseFormat(arg)
         elif re.match(r'-pw',arg):
             i += 1
             arg = sys.argv[i]
@@ -40,9 +47,11 @@ def readArgs():
     if 'credfile' not in args:
         args['credfile'] = 'cdl_config.json'
     if 'cachefile' not in args:
-        args['cachefile'] = 'fetch_cache.json'
+        args['cachefile'] = 'fetch_cache.sqlite'
     if 'fake' not in args:
         args['fake'] = False
+    if 'outformat' not in args:
+        args['outformat'] = 'json'
 
     return args
 
@@ -50,6 +59,7 @@ def getHelp():
     s = """
 
 rejector.py   [ -jr <json_result_file_name> ]
+              [ -of <format> ]
               [ -pw <cred_file_name> ]
               [ -fake ]
               [ -debug ]
@@ -69,6 +79,9 @@ database.
   -fake  :  Causes it to look up the necessary bits of information,
             but not actually make any changes
 
+  -of    :  Format of the result file: json (the default), jsonl,
+            csv or tsv
+
   -debug :  Turns on debugspew
 
   -help  :  Print this message
@@ -79,9 +92,19 @@ database.
 
 
 def getUserIDs(sapi, emails):
+    def lookup(email):
+        try:
+            return sapi.obtainUserID(email)
+        except sympl_api_highlevel.FetchError as e:
+            print('Could not look up user id for: ' + email)
+            print(e)
+            return None
+
+    with concurrent.futures.ThreadPoolExecutor(max_workers = sapi.lookup_workers) as ex:
+        found = list(ex.map(lookup, emails))
+
     uids = []
-    for email in emails:
-        uid = sapi.obtainUserID(email)
+    for email, uid in zip(emails, found):
         if uid is not None:
             uids.append({'email':email,'id':uid})
         else:
@@ -89,23 +112,50 @@ def getUserIDs(sapi, emails):
     return uids
 
 
-def elaboratePendingLinks(sapi, users):
-    all_pending_links = {}
-    for user in users:
-        user_pending_links = sapi.getListOfPendingRelationships(user['id'])
-        for link_id in user_pending_links:
-            all_pending_links[link_id] = user_pending_links[link_id]
-            all_pending_links[link_id]['user'] = user
+# Harvests every user's pending links, lookup_workers users at a time.
+# With delete, each user's links are handed to write_workers delete
+# workers (no faster than write_rate per second) as soon as that
+# user's pages are in, so the deletes overlap the harvesting rather
+# than waiting for all of it. Each link's 'result' is the DELETE's
+# status; the links are returned in the order of users.
+def elaboratePendingLinks(sapi, users, delete = False):
+    bucket = work_pool.TokenBucket(sapi.write_rate)
+
+    def harvest(user):
+        return sapi.getListOfPendingRelationships(user['id'])
+
+    def remove(linkid):
+        bucket.take()
+        return sapi.removePending(linkid)
+
+    by_user = {}
+    deletes = {}
+    with concurrent.futures.ThreadPoolExecutor(max_workers = sapi.lookup_workers) as harvesters, \
+         concurrent.futures.ThreadPoolExecutor(max_workers = sapi.write_workers) as deleters:
+        harvests = { harvesters.submit(harvest, user): n for n, user in enumerate(users) }
+        for f in concurrent.futures.as_completed(harvests):
+            n = harvests[f]
+            try:
+                by_user[n] = f.result()
+            except sympl_api_highlevel.FetchError as e:
+                print('Could not get pending links for: ' + users[n]['email'])
+                print(e)
+                continue
+            if delete:
+                for link_id in by_user[n]:
+                    deletes[link_id] = deleters.submit(remove, link_id)
+
+        all_pending_links = {}
+        for n, user in enumerate(users):
+            user_pending_links = by_user.get(n, {})
+            for link_id in user_pending_links:
+                all_pending_links[link_id] = user_pending_links[link_id]
+                all_pending_links[link_id]['user'] = user
+                if link_id in deletes:
+                    all_pending_links[link_id]['result'] = deletes[link_id].result()
     return all_pending_links
 
 
-
-def deletePendingLinks(sapi, links):
-    i = 0;
-    for linkid in links:
-        links[linkid]['result'] = sapi.removePending(linkid)
-
-
 if __name__ == '__main__':
     args = readArgs()
 
@@ -117,13 +167,18 @@ if __name__ == '__main__':
 
     users = getUserIDs(sapi,args['users'])
 
-    pending_links = elaboratePendingLinks(sapi,users)
-
     if not args['fake']:
-        print('-info- running actions')
-        deletePendingLinks(sapi, pending_links)
-
-    debughelpers.dumpJS(pending_links,args['jsoutfile'])
-
+        print('-info- gathering pending links and rejecting them')
+    pending_links = elaboratePendingLinks(sapi, users, not args['fake'])
+
+    # json keeps the links keyed by id; the row formats get one row
+    # per link, with its id in a column
+    if args['outformat'] == 'json':
+        debughelpers.dumpJS(pending_links,args['jsoutfile'])
+    else:
+        rows = ( dict(linkid = k, **v) for k, v in pending_links.items() )
+        result_writer.writeRows(rows, args['jsoutfile'], args['outformat'])
+
+    sapi.printStats()
     sapi.saveCache()
 
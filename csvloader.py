@@ -1,6 +1,6 @@
 import csv
-import json
 import re
+import result_writer
 
 def arrayToHashByIndex(ary):
     h = {}
@@ -21,8 +21,10 @@ def namesAndValsToHash(names, vals):
         idx += 1
     return h
 
-def load(fn, dialect = None):
-    result = []
+# yields the rows of the file one at a time as dicts keyed by the
+# header line, skipping blank lines and comments, so that a file of
+# any size can be worked through without holding it all
+def iterLoad(fn, dialect = None):
     try:
         with open(fn,'r',encoding='utf-8-sig') as fh:
             if dialect == 'tsv':
@@ -39,62 +41,28 @@ def load(fn, dialect = None):
                     if len(row):
                         comment = re.match(r'#', row[0])
                         if not comment:
-                            result.append(namesAndValsToHash(colnames,row))
+                            yield namesAndValsToHash(colnames,row)
                 rownum += 1
     except Exception as e:
         print('Could not open file: ' + fn)
         print(e)
 
-    return result
-
-
-# turn something into a string one way or another. Dicts get json'd
-# arrays that contains only strings get joined with commas, otherwise
-# they get json'd, too, and everything else gets to just be a str
-def my_stringify(thing):
-    ostr = ''
-    if isinstance(thing,list) or isinstance(thing,tuple):
-        nonstrings = False
-        for elem in thing:
-            if not isinstance(elem,str):
-                nonstrings = True
-                break;
-        if nonstrings:
-            ostr = json.dumps(thing)
-        else:
-            ostr = ', '.join(thing)
+def load(fn, dialect = None):
+    return list(iterLoad(fn, dialect))
 
-    elif isinstance(thing,dict):
-        ostr = json.dumps(thing)
-    else:
-        ostr = str(thing)
 
-    return ostr
+# kept under its old name for the callers that use it
+my_stringify = result_writer.stringify
 
 
+# writes data (a list of dicts) as CSV, or TSV with dialectname 'tsv'.
+# Without colnames, the columns are every key in any of the rows.
 def dump(data,fn,colnames = None, dialectname = None):
-    if colnames is None:
-        ch = {}
-        for datum in data:
-            dkeys = datum.keys()
-            for dkey in dkeys:
-                ch[dkey] = True
-        colnames = list(ch.keys())
-
     try:
-        with open(fn,'w') as fh:
-            if dialectname == 'tsv':
-                writer = csv.writer(fh, dialect=csv.excel_tab)
-            else:
-                writer = csv.writer(fh)
-
-            writer.writerow(colnames)
+        with result_writer.CSVRowWriter(fn, colnames, dialectname,
+                                        infer_rows = max(1, len(data))) as writer:
             for datum in data:
-                row = [ my_stringify(datum.get(x,'')) for x in colnames ]
-                writer.writerow(row)
+                writer.write(datum)
     except Exception as e:
         print('-err- Exception writing csv')
         print(e)
-
-
-
@@ -1,11 +1,17 @@
 import json 
+import result_writer
 
 def debugJS(thing):
     print(json.dumps(thing,indent=2,sort_keys=True))
 
+# lists are written an element at a time, and anything else is
+# encoded straight into the file rather than into one big string first
 def dumpJS(thing, fn):
-    with open(fn,'w') as fh:
-        fh.write(json.dumps(thing,indent=2,sort_keys=True))
+    if isinstance(thing, list):
+        result_writer.writeRows(thing, fn, 'json')
+    else:
+        with open(fn,'w') as fh:
+            json.dump(thing,fh,indent=2,sort_keys=True)
 
 def getJS(thing):
     return json.dumps(thing,indent=2,sort_keys=True)
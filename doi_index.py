@@ -0,0 +1,146 @@
+#!/usr/local/bin/python3
+
+# ****
+# Lawrence Berkeley National Lab
+#
+# An on-disk index between DOIs and publication system ids, built from
+# the reporting database's TSV exports (anything with 'system_id' and
+# 'doi' columns; 'title' and 'type' are kept too, if there). The
+# exports are read once into a sqlite file, which is only rebuilt when
+# one of them changes (by mtime or size) or the list of exports does;
+# after that, a lookup is an indexed query, and nothing is loaded into
+# memory.
+# ****
+
+import os
+import sqlite3
+import csvloader
+import sympl_api_highlevel
+
+# bump this if the layout of the index changes
+DOI_INDEX_VERSION = 2
+
+
+class DOIIndex:
+
+    def __init__(self, file_name, sources):
+        self.file_name = file_name
+        self.sources = list(sources)
+        # transactions are begun and committed by hand, so that a
+        # rebuild, DDL and all, is one of them
+        self.db = sqlite3.connect(file_name, isolation_level = None)
+        self.db.execute('''CREATE TABLE IF NOT EXISTS sources (
+                               path    TEXT PRIMARY KEY,
+                               mtime   REAL,
+                               size    INTEGER,
+                               version INTEGER)''')
+        if not self._upToDate():
+            self._rebuild()
+
+    def _stat(self, path):
+        st = os.stat(path)
+        return (os.path.abspath(path), st.st_mtime, st.st_size, DOI_INDEX_VERSION)
+
+    def _upToDate(self):
+        if self.db.execute('''SELECT 1 FROM sqlite_master
+                              WHERE type = 'table' AND name = 'pubs' ''').fetchone() is None:
+            return False
+        try:
+            wanted = set([ self._stat(path) for path in self.sources ])
+        except OSError as e:
+            print('-warn- could not read reporting export: ' + str(e))
+            wanted = None
+        have = set(self.db.execute('SELECT path, mtime, size, version FROM sources'))
+        if wanted is None:
+            # keep whatever was indexed before
+            return len(have) > 0
+        return wanted == have
+
+    # all in one transaction, so that if it is interrupted the old
+    # index is left as it was
+    def _rebuild(self):
+        print('-info- indexing DOIs from ' + ', '.join(self.sources))
+        db = self.db
+        db.execute('BEGIN')
+        try:
+            count = self._fill()
+            db.execute('COMMIT')
+        except BaseException:
+            db.execute('ROLLBACK')
+            raise
+        print('-info- indexed {0} DOIs'.format(count))
+
+    def _fill(self):
+        db = self.db
+        db.execute('DROP TABLE IF EXISTS pubs')
+        db.execute('DELETE FROM sources')
+        db.execute('''CREATE TABLE pubs (
+                          system_id TEXT NOT NULL,
+                          doi       TEXT NOT NULL,
+                          title     TEXT,
+                          type      TEXT)''')
+        insert = 'INSERT INTO pubs (system_id, doi, title, type) VALUES (?, ?, ?, ?)'
+        count = 0
+        for path in self.sources:
+            rows = []
+            for row in csvloader.iterLoad(path, 'tsv'):
+                sid = row.get('system_id',None)
+                doi = row.get('doi',None)
+                if sid and doi:
+                    rows.append((sid, sympl_api_highlevel.normalizeDOI(doi),
+                                 row.get('title') or None, row.get('type') or None))
+                if len(rows) >= 10000:
+                    db.executemany(insert, rows)
+                    count += len(rows)
+                    rows = []
+            db.executemany(insert, rows)
+            count += len(rows)
+            if os.path.exists(path):
+                db.execute('INSERT OR REPLACE INTO sources VALUES (?, ?, ?, ?)',
+                           self._stat(path))
+        db.execute('CREATE INDEX pubs_by_doi ON pubs (doi)')
+        db.execute('CREATE INDEX pubs_by_id ON pubs (system_id)')
+        return count
+
+    # the system id of the pub with this DOI. If the exports list more
+    # than one, the one listed last wins.
+    def systemID(self, doi):
+        row = self.db.execute('''SELECT system_id FROM pubs WHERE doi = ?
+                                 ORDER BY rowid DESC LIMIT 1''',
+                              (sympl_api_highlevel.normalizeDOI(doi),)).fetchone()
+        if row is None:
+            return None
+        return row[0]
+
+    # every distinct pub with this DOI, as { system_id: { 'title': ...,
+    # 'type': ... } } like getListOfPubsQuery gives; title and type are
+    # None if the exports do not have them
+    def pubs(self, doi):
+        found = {}
+        for sid, title, typ in self.db.execute(
+                '''SELECT system_id, title, type FROM pubs WHERE doi = ?
+                   ORDER BY rowid''',
+                (sympl_api_highlevel.normalizeDOI(doi),)):
+            found[sid] = { 'type': typ, 'title': title }
+        return found
+
+    # the DOI of the pub with this system id, lowercased
+    def doi(self, system_id):
+        row = self.db.execute('''SELECT doi FROM pubs WHERE system_id = ?
+                                 ORDER BY rowid DESC LIMIT 1''',
+                              (str(system_id),)).fetchone()
+        if row is None:
+            return None
+        return row[0]
+
+    # so that the index can stand in for a { doi: system_id } dict
+    def get(self, doi, default = None):
+        sid = self.systemID(doi)
+        if sid is None:
+            return default
+        return sid
+
+    def close(self):
+        if self.db is not None:
+            self.db.close()
+            self.db = None
@@ -0,0 +1,269 @@
+#!/usr/local/bin/python3
+
+# ****
+# Lawrence Berkeley National Lab
+#
+# Storage backends for the response cache used by
+# VerySimpleCachedFetcher. Both backends hold url -> parsed response,
+# along with when each entry was stored and last used and the HTTP
+# validators (ETag, Last-Modified) it came with, and offer the same
+# handful of methods:
+#
+#   load()                        get ready to serve lookups
+#   get(key)                      (value, stored_at, validators) or None;
+#                                 marks the entry used
+#   put(key, value, validators)   store a value, stamped with the
+#                                 current time
+#   restamp(key)                  mark an entry as freshly stored
+#   size()                        number of entries
+#   evict(n)                      drop the n least recently used entries
+#   save()                        make everything stored so far durable
+#   close()
+#
+# JSONCacheStore is the original whole-file-in-memory cache, and
+# SQLiteCacheStore keeps entries in an indexed on-disk table so
+# that startup and saves cost time proportional to what is touched,
+# not to the size of the cache.
+# ****
+
+import json
+import os
+import sqlite3
+import threading
+import time
+
+
+# picks a backend from the file name: .json files keep the old
+# behaviour, anything else is a sqlite database. A sqlite cache that
+# is being created for the first time will import legacy_file_name,
+# if it exists.
+def makeCacheStore(file_name, legacy_file_name = None):
+    if file_name.endswith('.json'):
+        return JSONCacheStore(file_name)
+    return SQLiteCacheStore(file_name, legacy_file_name)
+
+
+class JSONCacheStore:
+
+    def __init__(self, file_name):
+        self.file_name = file_name
+        self.cache = {}
+        self.dirty = False
+        self.lock = threading.Lock()
+
+    # entries are kept as [value, stored_at, accessed_at, validators].
+    # Files written before entries had timestamps hold bare values;
+    # those are stamped with the file's mtime.
+    def load(self):
+        try:
+            with open(self.file_name,'r') as fh:
+                raw = json.load(fh)
+            mtime = os.path.getmtime(self.file_name)
+            self.cache = {}
+            for k, v in raw.items():
+                if isinstance(v, list) and len(v) == 4:
+                    self.cache[k] = v
+                elif isinstance(v, list) and len(v) == 3:
+                    self.cache[k] = v + [ None ]
+                else:
+                    self.cache[k] = [ v, mtime, mtime, None ]
+            self.dirty = False
+        except Exception as e:
+            print("Exception loading from: " + self.file_name)
+            print(e)
+
+    def get(self, key):
+        entry = self.cache.get(key)
+        if entry is None:
+            return None
+        entry[2] = time.time()
+        self.dirty = True
+        return entry[0], entry[1], entry[3]
+
+    def put(self, key, value, validators = None):
+        now = time.time()
+        with self.lock:
+            self.dirty = True
+            self.cache[key] = [ value, now, now, validators ]
+
+    def restamp(self, key):
+        with self.lock:
+            entry = self.cache.get(key)
+            if entry is not None:
+                entry[1] = time.time()
+                self.dirty = True
+
+    def size(self):
+        return len(self.cache)
+
+    def evict(self, n):
+        with self.lock:
+            oldest = sorted(self.cache, key = lambda k: self.cache[k][2])[:n]
+            for k in oldest:
+                del self.cache[k]
+            self.dirty = True
+
+    def save(self):
+        if self.dirty:
+            try:
+                with self.lock:
+                    with open(self.file_name,'w') as fh:
+                        fh.write(json.dumps(self.cache))
+                        self.dirty = False
+            except Exception as e:
+                print("Exception saving to " + self.file_name)
+                print(e)
+
+    def close(self):
+        self.save()
+
+
+class SQLiteCacheStore:
+
+    def __init__(self, file_name, legacy_file_name = None, commit_every = 100):
+        self.file_name = file_name
+        self.legacy_file_name = legacy_file_name
+        self.commit_every = commit_every
+        self.uncommitted = 0
+        # last-use times are only written out at commit time, so that
+        # a cache hit does not turn into a write
+        self.touched = {}
+        self.db = None
+        # one connection is shared by all the fetcher's threads, so
+        # every use of it is serialized here
+        self.lock = threading.Lock()
+
+    def load(self):
+        try:
+            self.db = sqlite3.connect(self.file_name, check_same_thread = False)
+            self.db.execute('PRAGMA journal_mode=WAL')
+            self.db.execute('PRAGMA synchronous=NORMAL')
+            self.db.execute('''CREATE TABLE IF NOT EXISTS entries (
+                                   key       TEXT PRIMARY KEY,
+                                   value     TEXT NOT NULL,
+                                   stored_at REAL NOT NULL)''')
+            columns = [ r[1] for r in self.db.execute('PRAGMA table_info(entries)') ]
+            if 'accessed_at' not in columns:
+                self.db.execute('ALTER TABLE entries ADD COLUMN accessed_at REAL')
+                self.db.execute('UPDATE entries SET accessed_at = stored_at')
+            if 'etag' not in columns:
+                self.db.execute('ALTER TABLE entries ADD COLUMN etag TEXT')
+                self.db.execute('ALTER TABLE entries ADD COLUMN last_modified TEXT')
+            self.db.execute('''CREATE INDEX IF NOT EXISTS entries_by_use
+                               ON entries (accessed_at)''')
+            self.db.execute('''CREATE TABLE IF NOT EXISTS meta (
+                                   name  TEXT PRIMARY KEY,
+                                   value TEXT)''')
+            self.db.commit()
+            self._migrate()
+        except Exception as e:
+            print("Exception loading from: " + self.file_name)
+            print(e)
+            self.db = None
+
+    # one-time import of an old fetch_cache.json. Its entries carry no
+    # timestamps, so they are stamped with the file's mtime.
+    def _migrate(self):
+        done = self.db.execute("SELECT value FROM meta WHERE name = 'migrated_from'").fetchone()
+        if done is not None:
+            return
+        legacy = self.legacy_file_name
+        if legacy and os.path.exists(legacy):
+            print('-info- importing legacy cache ' + legacy + ' into ' + self.file_name)
+            with open(legacy,'r') as fh:
+                old = json.load(fh)
+            stored_at = os.path.getmtime(legacy)
+            self.db.executemany(
+                'INSERT OR IGNORE INTO entries (key, value, stored_at, accessed_at) VALUES (?, ?, ?, ?)',
+                ((k, json.dumps(v), stored_at, stored_at) for k, v in old.items()))
+        self.db.execute("INSERT OR REPLACE INTO meta (name, value) VALUES ('migrated_from', ?)",
+                        (legacy or '',))
+        self.db.commit()
+
+    def get(self, key):
+        if self.db is None:
+            return None
+        with self.lock:
+            row = self.db.execute('''SELECT value, stored_at, etag, last_modified
+                                     FROM entries WHERE key = ?''',
+                                  (key,)).fetchone()
+            if row is None:
+                return None
+            self.touched[key] = time.time()
+        validators = None
+        if row[2] or row[3]:
+            validators = { 'etag': row[2], 'last_modified': row[3] }
+        return json.loads(row[0]), row[1], validators
+
+    def put(self, key, value, validators = None):
+        if self.db is None:
+            return
+        now = time.time()
+        validators = validators or {}
+        with self.lock:
+            self.db.execute(
+                '''INSERT OR REPLACE INTO entries
+                   (key, value, stored_at, accessed_at, etag, last_modified)
+                   VALUES (?, ?, ?, ?, ?, ?)''',
+                (key, json.dumps(value), now, now,
+                 validators.get('etag'), validators.get('last_modified')))
+            self.touched.pop(key, None)
+            self._wrote()
+
+    def restamp(self, key):
+        if self.db is None:
+            return
+        with self.lock:
+            self.db.execute('UPDATE entries SET stored_at = ? WHERE key = ?',
+                            (time.time(), key))
+            self._wrote()
+
+    # callers hold self.lock
+    def _wrote(self):
+        self.uncommitted += 1
+        if self.uncommitted >= self.commit_every:
+            self._commit()
+
+    def size(self):
+        if self.db is None:
+            return 0
+        with self.lock:
+            return self.db.execute('SELECT COUNT(*) FROM entries').fetchone()[0]
+
+    def evict(self, n):
+        if self.db is None:
+            return
+        with self.lock:
+            self._flushTouched()
+            self.db.execute('''DELETE FROM entries WHERE key IN (
+                                   SELECT key FROM entries
+                                   ORDER BY accessed_at LIMIT ?)''', (n,))
+            self._commit()
+
+    # callers hold self.lock
+    def _flushTouched(self):
+        if len(self.touched):
+            self.db.executemany('UPDATE entries SET accessed_at = ? WHERE key = ?',
+                                ((t, k) for k, t in self.touched.items()))
+            self.touched = {}
+
+    def _commit(self):
+        self._flushTouched()
+        self.db.commit()
+        self.uncommitted = 0
+
+    def save(self):
+        if self.db is None:
+            return
+        try:
+            with self.lock:
+                self._commit()
+        except Exception as e:
+            print("Exception saving to " + self.file_name)
+            print(e)
+
+    def close(self):
+        if self.db is not None:
+            self.save()
+            self.db.close()
+            self.db = None
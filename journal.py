@@ -0,0 +1,116 @@
+#!/usr/local/bin/python3
+
+# ****
+# Lawrence Berkeley National Lab
+#
+# Append-only record of the work a bulk run has finished, so that an
+# interrupted run can pick up where it stopped. Each line of the file
+# is one JSON record
+#
+#   { "kind": ..., "key": ..., "data": ... }
+#
+# and the file is fsynced every sync_every records, and whenever
+# sync() is called. Only the position of each record is kept in
+# memory; its data is read back from the file when asked for.
+# ****
+
+import hashlib
+import json
+import os
+import threading
+
+
+# a short stable key for any JSON-able thing, for use as a record key
+def digest(thing):
+    text = json.dumps(thing, sort_keys = True)
+    return hashlib.sha1(text.encode('utf-8')).hexdigest()[:20]
+
+
+class Journal:
+
+    # with resume, the records already in file_name are kept and can
+    # be looked up; otherwise the file is started afresh
+    def __init__(self, file_name, resume = False, sync_every = 50):
+        self.file_name = file_name
+        self.sync_every = sync_every
+        self.unsynced = 0
+        self.offsets = {}
+        self.lock = threading.Lock()
+        if resume and os.path.exists(file_name):
+            self._scan()
+            self.out = open(file_name, 'ab')
+        else:
+            self.out = open(file_name, 'wb')
+        # what was already there, as against what this run records
+        self.earlier = set(self.offsets)
+        self.reader = open(file_name, 'rb')
+
+    # finds where every record is. A last line that was only partly
+    # written when the run stopped is cut off.
+    def _scan(self):
+        good = 0
+        with open(self.file_name, 'rb') as fh:
+            while True:
+                pos = fh.tell()
+                line = fh.readline()
+                if not line:
+                    break
+                try:
+                    rec = json.loads(line)
+                except ValueError:
+                    break
+                if not line.endswith(b'\n'):
+                    break
+                self.offsets[(rec['kind'], rec['key'])] = pos
+                good = fh.tell()
+        if good < os.path.getsize(self.file_name):
+            print('-warn- dropping incomplete record at the end of ' + self.file_name)
+            with open(self.file_name, 'r+b') as fh:
+                fh.truncate(good)
+
+    def has(self, kind, key):
+        return (kind, key) in self.offsets
+
+    # whether the record was in the file before this run opened it
+    def fromEarlierRun(self, kind, key):
+        return (kind, key) in self.earlier
+
+    # the data of the latest record of this kind and key, or None
+    def get(self, kind, key):
+        pos = self.offsets.get((kind, key))
+        if pos is None:
+            return None
+        with self.lock:
+            self.out.flush()
+            self.reader.seek(pos)
+            return json.loads(self.reader.readline())['data']
+
+    def record(self, kind, key, data = None):
+        line = json.dumps({ 'kind': kind, 'key': key, 'data': data }) + '\n'
+        with self.lock:
+            self.out.seek(0, os.SEEK_END)
+            self.offsets[(kind, key)] = self.out.tell()
+            self.out.write(line.encode('utf-8'))
+            self.unsynced += 1
+            if self.unsynced >= self.sync_every:
+                self._sync()
+
+    def sync(self):
+        with self.lock:
+            self._sync()
+
+    # callers hold self.lock
+    def _sync(self):
+        self.out.flush()
+        os.fsync(self.out.fileno())
+        self.unsynced = 0
+
+    def count(self, kind):
+        return len([ k for k in self.offsets if k[0] == kind ])
+
+    def close(self):
+        if self.out is not None:
+            self.sync()
+            self.out.close()
+            self.reader.close()
+            self.out = None
@@ -14,9 +14,14 @@
 
 import re
 import sys
+import concurrent.futures
+import itertools
 import csvloader
+import result_writer
+import journal
+import doi_index
 import sympl_api_highlevel
-import debughelpers
+import work_pool
 
 # I loathe parseargs, sorry:
 def readArgs():
@@ -48,6 +53,28 @@ def readArgs():
             args['credfile'] = arg
         elif re.match(r'-tab', arg):
             args['dialect'] = 'tsv'
+        elif re.match(r'-of', arg):
+            i += 1
+            arg = sys.argv[i]
+            args['outformats'] = result_writer.parseFormats(arg)
+        elif re.match(r'-rx', arg):
+            args['grantregex'] = True
+        elif re.match(r'-resync', arg):
+            args['grantresync'] = True
+        elif re.match(r'-resume', arg):
+            args['resume'] = True
+        elif re.match(r'-journal', arg):
+            i += 1
+            arg = sys.argv[i]
+            args['journalfile'] = arg
+        elif re.match(r'-rdb', arg):
+            i += 1
+            arg = sys.argv[i]
+            args.setdefault('reportfiles', []).append(arg)
+        elif re.match(r'-chunk', arg):
+            i += 1
+            arg = sys.argv[i]
+            args['chunksize'] = int(arg)
 
 
     if 'jsoutfile' not in args:
@@ -57,11 +84,29 @@ def readArgs():
     if 'credfile' not in args:
         args['credfile'] = 'cdl_config.json'
     if 'cachefile' not in args:
-        args['cachefile'] = 'fetch_cache.json'
+        args['cachefile'] = 'fetch_cache.sqlite'
     if 'fake' not in args:
         args['fake'] = False
     if 'dialect' not in args:
         args['dialect'] = 'csv'
+    if 'outformats' not in args:
+        args['outformats'] = [ 'json', args['dialect'] ]
+    if 'grantregex' not in args:
+        args['grantregex'] = False
+    if 'grantresync' not in args:
+        args['grantresync'] = False
+    if 'grantfile' not in args:
+        args['grantfile'] = 'grant_snapshot.json'
+    if 'chunksize' not in args:
+        args['chunksize'] = 200
+    if 'reportfiles' not in args:
+        args['reportfiles'] = []
+    if 'doiindexfile' not in args:
+        args['doiindexfile'] = 'doi_index.sqlite'
+    if 'resume' not in args:
+        args['resume'] = False
+    if 'journalfile' not in args:
+        args['journalfile'] = 'link_journal.jsonl'
 
     return args
 
@@ -73,6 +118,13 @@ link_maker.py   -infile <file_name>
               [ -cr <csv_result_file_name> ]
               [ -pw <cred_file_name> ]
               [ -tab ]
+              [ -of <formats> ]
+              [ -rx ]
+              [ -resync ]
+              [ -chunk <rows> ]
+              [ -rdb <reporting_export.tsv> ... ]
+              [ -resume ]
+              [ -journal <journal_file_name> ]
               [ -fake ]
               [ -debug ]
               [ -help ]
@@ -96,13 +148,133 @@ database.
   -tab   :  Read config from a TAB delimited file. Write TAB delimited
             results. If not present, use and make .csv
 
+  -of    :  Which result files to write, as a comma separated list of
+            csv, tsv (written to the -cr file) and json, jsonl (written
+            to the -jr file). Default json,csv or, with -tab, json,tsv
+
+  -rx    :  Treat the grant column as a regular expression to search
+            grant names with, rather than a name to match exactly
+
+  -resync : Fetch the whole grant catalogue again instead of only
+            the grants changed since the last run
+
+  -chunk :  How many input rows to look up and link at a time
+            (default 200). Results are written out after each chunk.
+
+  -rdb   :  A reporting database export (TSV with system_id and doi
+            columns) to look DOIs up in before asking the API. May be
+            given more than once. The exports are indexed into
+            doi_index.sqlite, which is only rebuilt when one changes.
+
+  -resume : Carry on from where an interrupted run stopped. Rows it
+            finished are copied from the journal, rows it looked up
+            are not looked up again, and links it created are not
+            created again.
+
+  -journal : Where to keep the record of finished work that -resume
+            uses (default link_journal.jsonl). Without -resume it is
+            started afresh.
+
   -help  :  Print this message
 
     """
     return s
 
 
-def elaborateRequestList(rl, sapi):
+# Calls fn on each item, workers at a time. Returns { item: result }
+# for the lookups that completed and { item: FetchError } for those
+# that could not be, so that a request that failed is never mistaken
+# for one that found nothing.
+def lookupAll(fn, items, workers):
+    def call(item):
+        try:
+            return fn(item), None
+        except sympl_api_highlevel.FetchError as e:
+            return None, e
+
+    with concurrent.futures.ThreadPoolExecutor(max_workers = workers) as ex:
+        results = list(ex.map(call, items))
+
+    found = {}
+    failed = {}
+    for item, (v, e) in zip(items, results):
+        if e is None:
+            found[item] = v
+        else:
+            failed[item] = e
+    return found, failed
+
+
+# Every distinct user, grant and DOI in the request list is looked up
+# exactly once, user and relationship lookups in parallel, rather than
+# once per row. DOIs are looked for first in local (a DOIIndex of the
+# reporting exports), if given, and only those it does not settle to a
+# single pub go to the API. Returns the lookup tables that
+# elaborateRequestList joins back onto the rows.
+def resolveDistinct(rl, sapi, grant_regex = False, local = None):
+    users  = list(dict.fromkeys([ req.get('user', '')  for req in rl if len(req.get('user', '')) ]))
+    grants = list(dict.fromkeys([ req.get('grant', '') for req in rl if len(req.get('grant', '')) ]))
+    dois   = list(dict.fromkeys([ req.get('doi', '')   for req in rl if len(req.get('doi', '')) ]))
+
+    found = {}
+    found['grants'] = {}
+    for grant in grants:
+        matching_grants = sapi.findGrantsMatching(grant, 'funder-name', not grant_regex)
+        names = {}
+        if len(matching_grants) == 1:
+            names[matching_grants[0]] = sapi.getGrantName(matching_grants[0])
+        found['grants'][grant] = (matching_grants, names)
+
+    found['users'], found['users_failed'] = lookupAll(sapi.obtainUserID, users,
+                                                     sapi.lookup_workers)
+
+    found['pubs'] = {}
+    remote_dois = dois
+    if local is not None:
+        remote_dois = []
+        for doi in dois:
+            pubs = local.pubs(doi)
+            if len(pubs) == 1:
+                found['pubs'][doi] = pubs
+            else:
+                remote_dois.append(doi)
+        batch = int(sapi.fetcher.config.get('doi_batch_size', 20))
+        saved = (len(dois) + batch - 1) // batch - (len(remote_dois) + batch - 1) // batch
+        print('-info- local DOI index: {0} of {1} DOIs found, {2} API searches saved'.format(
+              len(dois) - len(remote_dois), len(dois), saved))
+
+    found['pubs_failed'] = {}
+    found['pubs'].update(sapi.resolveDOIs(remote_dois, failures = found['pubs_failed']))
+
+    # only pubs that resolved uniquely, on a row with something to link,
+    # need their existing relationships checked
+    pubids = []
+    for req in rl:
+        pubs = found['pubs'].get(req.get('doi', ''), {})
+        if len(pubs) != 1:
+            continue
+        grant_ok = len(found['grants'].get(req.get('grant', ''), ([], {}))[0]) == 1
+        user_ok  = found['users'].get(req.get('user', '')) is not None
+        if grant_ok or user_ok:
+            pubids.append(list(pubs.keys())[0])
+    rel_row_lookups = len(pubids)
+    pubids = list(dict.fromkeys(pubids))
+
+    found['rels'], found['rels_failed'] = lookupAll(sapi.getPubRelationships, pubids,
+                                                   sapi.lookup_workers)
+
+    # what the old one-row-at-a-time loop would have looked up
+    row_lookups = rel_row_lookups
+    for req in rl:
+        row_lookups += len([ k for k in ('user', 'grant', 'doi') if len(req.get(k, '')) ])
+    distinct = len(users) + len(grants) + len(dois) + len(pubids)
+    print('-info- dedup: {0} distinct lookups for {1} row lookups ({2} saved)'.format(
+          distinct, row_lookups, row_lookups - distinct))
+
+    return found
+
+
+def elaborateRequestList(rl, sapi, grant_regex = False, local = None):
 
     pub_rel_grant_type_id = sapi.findRelationshipTypeID('publication-grant-funded')
     pub_rel_author_type_id = sapi.findRelationshipTypeID('publication-user-authorship')
@@ -114,6 +286,8 @@ def elaborateRequestList(rl, sapi):
         print('-err- could not find author/pub typeid')
         return
 
+    found = resolveDistinct(rl, sapi, grant_regex, local)
+
     for req in rl:
         req['elab_messages'] = []
 
@@ -122,12 +296,12 @@ def elaborateRequestList(rl, sapi):
         req['grantid'] = None
 
         if len(grant):
-            matching_grants = sapi.findGrantsMatching(grant, 'funder-name')
+            matching_grants, grant_names = found['grants'][grant]
             grant_count = len(matching_grants)
             if grant_count == 1:
                 req['grantid'] = matching_grants[0]
                 req['try_link_grant'] = True
-                req['grant_matched_name'] = sapi.getGrantName(req['grantid'])
+                req['grant_matched_name'] = grant_names[req['grantid']]
             elif grant_count == 0:
                 req['elab_messages'].append('grant_not_found')
             else:
@@ -138,8 +312,11 @@ def elaborateRequestList(rl, sapi):
         req['try_link_user'] = False
         req['userid'] = None
         if len(user):
-            userid = sapi.obtainUserID(user)
-            if userid is not None:
+            userid = found['users'].get(user)
+            if user in found['users_failed']:
+                req['elab_messages'].append('user_lookup_failed: ' +
+                        found['users_failed'][user].reason)
+            elif userid is not None:
                 req['try_link_user'] = True
                 req['userid'] = userid
             else:
@@ -147,8 +324,11 @@ def elaborateRequestList(rl, sapi):
 
         doi = req.get('doi', '')
         req['pubid'] = None
-        if len(doi):
-            pubs = sapi.getListOfPubsQuery('"' + doi + '"')
+        if len(doi) and doi in found['pubs_failed']:
+            req['elab_messages'].append('pub_lookup_failed: ' +
+                    found['pubs_failed'][doi].reason)
+        elif len(doi):
+            pubs = found['pubs'][doi]
             pubids = list(pubs.keys())
             pubs_count = len(pubids)
             if pubs_count == 1:
@@ -169,8 +349,14 @@ def elaborateRequestList(rl, sapi):
 
         # check this pub to see if the links might already exist. If so,
         # then nothing to do
+        if req['pubid'] in found['rels_failed']:
+            req['try_link_grant'] = False
+            req['try_link_user'] = False
+            req['elab_messages'].append('relationship_lookup_failed: ' +
+                    found['rels_failed'][req['pubid']].reason)
+
         if req['try_link_grant'] or req['try_link_user']:
-            existing_rels = sapi.getPubRelationships(req['pubid'])
+            existing_rels = found['rels'][req['pubid']]
 
             if req['try_link_grant']:
                 grant_link_exists = sapi.checkRelationshipExists(existing_rels,
@@ -191,7 +377,14 @@ def elaborateRequestList(rl, sapi):
                     req['elab_messages'].append('user_link_does_not_exist')
 
 
-def runRequestList(rl, sapi):
+# If jl (a journal.Journal) is given, every link is recorded in it as
+# an 'intent' before it is posted and as a 'write', with the server's
+# answer, once it has been. Links already written are not posted
+# again. A link with an intent but no write may or may not have been
+# made before the run stopped, so the pub's relationships are checked
+# on the server before it is posted again. Rows asking for the same
+# link share one post and its answer.
+def runRequestList(rl, sapi, jl = None):
 
     pub_rel_grant_type_id = sapi.findRelationshipTypeID('publication-grant-funded')
     pub_rel_author_type_id = sapi.findRelationshipTypeID('publication-user-authorship')
@@ -203,6 +396,7 @@ def runRequestList(rl, sapi):
         print('-err- could not find author/pub typeid')
         return
 
+    jobs = []
     for req in rl:
 
         req['attempt_messages'] = []
@@ -211,28 +405,125 @@ def runRequestList(rl, sapi):
         for what in whats:
 
             if req['try_link_' + what]:
-                try:
-                    payload = {
-                        '@xmlns': 'http://www.symplectic.co.uk/publications/api',
-                        'from-object': 'publication(' + req['pubid'] + ')',
-                    }
-                    if what == 'user':
-                        payload['to-object'] = 'user(' + req['userid'] + ')'
-                        payload['type-id'] = pub_rel_author_type_id
-                    elif what == 'grant':
-                        payload['to-object'] = 'grant(' + req['grantid'] + ')'
-                        payload['type-id'] = pub_rel_grant_type_id
-
-                    req['link_' + what + '_payload'] = payload
-                    url = 'relationships'
-                    res = sapi.post(url, req['link_' +what + '_payload'], 'import-relationship')
-                    err = res['feed']['entry'].get('error')
-                    if err is not None:
-                        req['attempt_messages'].append(res['feed']['entry']['error']['#text'])
-                    req['link_' + what + '_result'] = res
-                except Exception as e:
-                    req['attempt_message'].append('link_' + what + '_exception: ' + repr(e))
-
+                payload = {
+                    '@xmlns': 'http://www.symplectic.co.uk/publications/api',
+                    'from-object': 'publication(' + req['pubid'] + ')',
+                }
+                if what == 'user':
+                    payload['to-object'] = 'user(' + req['userid'] + ')'
+                    payload['type-id'] = pub_rel_author_type_id
+                elif what == 'grant':
+                    payload['to-object'] = 'grant(' + req['grantid'] + ')'
+                    payload['type-id'] = pub_rel_grant_type_id
+
+                req['link_' + what + '_payload'] = payload
+                jobs.append((req, what))
+
+    type_ids = { 'user': pub_rel_author_type_id, 'grant': pub_rel_grant_type_id }
+
+    def payloadKey(job):
+        req, what = job
+        return journal.digest(req['link_' + what + '_payload'])
+
+    written = {}
+    uncertain = set()
+    to_post = []
+    seen = set()
+    for job in jobs:
+        key = payloadKey(job)
+        if key in seen:
+            continue
+        seen.add(key)
+        if jl is not None and jl.has('write', key):
+            written[key] = jl.get('write', key)
+            continue
+        if jl is not None and jl.has('intent', key):
+            uncertain.add(key)
+        to_post.append(job)
+
+    if jl is not None:
+        for job in to_post:
+            jl.record('intent', payloadKey(job))
+        jl.sync()
+
+    # the posts run write_workers at a time, no faster than write_rate
+    # per second; their results are recorded back in request order
+    def post(job):
+        req, what = job
+        try:
+            if payloadKey(job) in uncertain:
+                rels = sapi.getPubRelationships(req['pubid'], use_cache = False)
+                if sapi.checkRelationshipExists(rels, req[what + 'id'], type_ids[what]):
+                    return None, None
+            url = 'relationships'
+            return sapi.post(url, req['link_' + what + '_payload'], 'import-relationship'), None
+        except Exception as e:
+            return None, e
+
+    bucket = work_pool.TokenBucket(sapi.write_rate)
+    posted = {}
+    for job, result in zip(to_post, work_pool.runOrdered(post, to_post,
+                                                         sapi.write_workers, bucket)):
+        key = payloadKey(job)
+        posted[key] = result
+        res, exc = result
+        if jl is not None and exc is None:
+            jl.record('write', key, res)
+
+    for req, what in jobs:
+        key = payloadKey((req, what))
+        if key in written:
+            res, exc = written[key], None
+            if jl.fromEarlierRun('write', key):
+                req['attempt_messages'].append('link_' + what + '_done_in_earlier_run')
+        else:
+            res, exc = posted[key]
+        try:
+            if res is None and exc is None:
+                req['attempt_messages'].append('link_' + what + '_exists')
+                continue
+            if isinstance(exc, sympl_api_highlevel.FetchError):
+                req['attempt_messages'].append('link_' + what + '_failed: ' + exc.reason)
+                continue
+            if exc is not None:
+                raise exc
+            err = res['feed']['entry'].get('error')
+            if err is not None:
+                req['attempt_messages'].append(res['feed']['entry']['error']['#text'])
+            req['link_' + what + '_result'] = res
+        except Exception as e:
+            req['attempt_messages'].append('link_' + what + '_exception: ' + repr(e))
+
+
+# the columns link_maker adds to each input row, in the order they are
+# written after the input's own columns
+RESULT_COLUMNS = [
+    'elab_messages', 'attempt_messages',
+    'pubid', 'pub_matched_title', 'pub_matched_type',
+    'userid', 'try_link_user', 'link_user_payload', 'link_user_result',
+    'grantid', 'grant_matched_name', 'try_link_grant', 'link_grant_payload',
+    'link_grant_result',
+]
+
+
+# True if any of a row's messages says a request could not be
+# completed. Such rows are left out of the journal, so that -resume
+# tries them again rather than copying the failure forward.
+def hasFailure(messages):
+    for m in messages:
+        if re.match(r'\w+_(lookup_)?failed\b', m):
+            return True
+    return False
+
+
+# yields lists of up to n items from an iterable
+def chunked(items, n):
+    it = iter(items)
+    while True:
+        chunk = list(itertools.islice(it, n))
+        if not len(chunk):
+            return
+        yield chunk
 
 
 if __name__ == '__main__':
@@ -242,20 +533,94 @@ if __name__ == '__main__':
         print(getHelp())
         sys.exit()
 
-    sapi = sympl_api_highlevel.SymplecticAPI(args)
-
-    print('-info- loading input file: ' + args['infile'])
-    reqlist = csvloader.load(args['infile'], args['dialect'])
-
-    print('-info- preparing list of actions from input')
-    elaborateRequestList(reqlist, sapi)
-
-    if not args['fake']:
-        print('-info- running actions')
-        runRequestList(reqlist, sapi)
+    out_files = []
+    for fmt in args['outformats']:
+        if fmt in ('csv', 'tsv'):
+            out_files.append((fmt, args['csvoutfile']))
+        else:
+            out_files.append((fmt, args['jsoutfile']))
+    if len(set([ fn for _, fn in out_files ])) < len(out_files):
+        print('-err- two output formats would be written to the same file')
+        sys.exit()
 
-    print('-info- saving results')
-    debughelpers.dumpJS(reqlist, args['jsoutfile'])
-    csvloader.dump(reqlist, args['csvoutfile'], None, args['dialect'])
+    sapi = sympl_api_highlevel.SymplecticAPI(args)
 
+    local = None
+    if len(args['reportfiles']):
+        local = doi_index.DOIIndex(args['doiindexfile'], args['reportfiles'])
+
+    # rows are read, looked up, linked and written chunksize at a
+    # time, so memory does not grow with the input and everything
+    # finished so far is on disk if the run stops part way
+    print('-info- reading input file: ' + args['infile'])
+    rows = csvloader.iterLoad(args['infile'], args['dialect'])
+
+    # each row's lookups ('elab') and final result ('done') go in the
+    # journal, keyed by its position and contents, alongside the links
+    # runRequestList records
+    jl = journal.Journal(args['journalfile'], args['resume'])
+    if args['resume']:
+        print('-info- resuming: journal has {0} finished rows and {1} links made'.format(
+              jl.count('done'), jl.count('write')))
+
+    writers = None
+    done = 0
+    skipped = 0
+    try:
+        for reqlist in chunked(rows, args['chunksize']):
+            if writers is None:
+                colnames = list(reqlist[0].keys())
+                colnames += [ c for c in RESULT_COLUMNS if c not in colnames ]
+                writers = [ result_writer.openWriter(fmt, fn, colnames)
+                            for fmt, fn in out_files ]
+
+            keys = [ journal.digest([ done + n, req ]) for n, req in enumerate(reqlist) ]
+            to_elab = []
+            to_run = []
+            for key, req in zip(keys, reqlist):
+                if jl.has('done', key):
+                    req.update(jl.get('done', key))
+                    skipped += 1
+                    continue
+                if jl.has('elab', key):
+                    req.update(jl.get('elab', key))
+                else:
+                    to_elab.append((key, req))
+                to_run.append((key, req))
+
+            if len(to_elab):
+                print('-info- preparing actions for rows {0} to {1}'.format(
+                      done + 1, done + len(reqlist)))
+                elaborateRequestList([ req for _, req in to_elab ], sapi, args['grantregex'],
+                                     local)
+                for key, req in to_elab:
+                    if 'elab_messages' in req and not hasFailure(req['elab_messages']):
+                        jl.record('elab', key, req)
+
+            if not args['fake'] and len(to_run):
+                print('-info- running actions')
+                runRequestList([ req for _, req in to_run ], sapi, jl)
+                for key, req in to_run:
+                    if not hasFailure(req.get('elab_messages', []) +
+                                      req.get('attempt_messages', [])):
+                        jl.record('done', key, req)
+            jl.sync()
+
+            for w in writers:
+                for req in reqlist:
+                    w.write(req)
+                w.flush()
+            sapi.saveCache()
+            done += len(reqlist)
+    finally:
+        jl.close()
+        if writers is None:
+            # no input rows, but still leave empty result files
+            writers = [ result_writer.openWriter(fmt, fn, RESULT_COLUMNS)
+                        for fmt, fn in out_files ]
+        for w in writers:
+            w.close()
+
+    print('-info- {0} rows done, {1} of them in an earlier run'.format(done, skipped))
+    sapi.printStats()
     sapi.saveCache()
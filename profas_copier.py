@@ -8,6 +8,7 @@ import re
 import urllib.parse
 import sympl_api_highlevel
 import debughelpers
+import result_writer
 import sys
 
 # I loathe parseargs, sorry:
@@ -31,6 +32,13 @@ def readArgs():
         elif re.match(r'-pw',arg):
             i += 1
             args['credfile'] = sys.argv[i]
+        elif re.match(r'-jr',arg):
+            i += 1
+            args['jsoutfile'] = sys.argv[i]
+        elif re.match(r'-of',arg):
+            i += 1
+            arg = sys.argv[i]
+            args['outformat'] = result_writer.parseFormat(arg)
         elif re.match(r'-src',arg):
             i += 1
             args['src'] = sys.argv[i]
@@ -41,11 +49,15 @@ def readArgs():
     if 'credfile' not in args:
         args['credfile'] = 'cdl_config.json'
     if 'cachefile' not in args:
-        args['cachefile'] = 'fetch_cache.json'
+        args['cachefile'] = 'fetch_cache.sqlite'
     if 'dry' not in args:
         args['dry'] = False 
     if 'remove' not in args:
         args['remove'] = False 
+    if 'jsoutfile' not in args:
+        args['jsoutfile'] = 'results.json'
+    if 'outformat' not in args:
+        args['outformat'] = 'json'
 
     return args
 
@@ -56,6 +68,7 @@ profas_pusher.py
       -src <email of user to copy FROM>
       -tgt <email of user to copy TO>
     [ -jr <json_result_file_name> ]
+    [ -of <format> ]
     [ -pw <cred_file_name> ]
     [ -dry ]
     [ -rm ]
@@ -79,6 +92,9 @@ database.
 
   -rm    :  Causes the old existing links to be removed
 
+  -of    :  Format of the result file: json (the default), jsonl,
+            csv or tsv
+
   -debug :  Turns on debugspew
 
   -help  :  Print this message
@@ -91,7 +107,12 @@ database.
 def getUserIDs(sapi, emails):
     uids = []
     for email in emails:
-        uid = sapi.obtainUserID(email)
+        try:
+            uid = sapi.obtainUserID(email)
+        except sympl_api_highlevel.FetchError as e:
+            print('Could not look up user id for: ' + email)
+            print(e)
+            continue
         if uid is not None:
             uids.append({'email':email,'id':uid})
         else:
@@ -137,7 +158,11 @@ def prepareNewLinks(userid, srcrels):
 def createNewLinks(sapi, work_to_do):
     count = 0
     for thing in work_to_do:
-        res = sapi.post(thing['url'],thing['payload'],thing['topname'])
+        try:
+            res = sapi.post(thing['url'],thing['payload'],thing['topname'])
+        except sympl_api_highlevel.FetchError as e:
+            print(e)
+            res = 'req_failed'
         thing['create_result'] = res
         count += 1
 
@@ -172,13 +197,16 @@ if __name__ == '__main__':
 
     related_profas = sapi.getUsersProfessionalActivityRelationships(src_id)
 
+    results = []
+
     if True:
         work_to_do     = prepareNewLinks(tgt_id, related_profas)
 
         if args['dry']:
-            debughelp.debugJS(work_to_do)
+            debughelpers.debugJS(work_to_do)
         else:
             createNewLinks(sapi, work_to_do)
+        results += [ dict(action = 'create', **thing) for thing in work_to_do ]
 
     if True:
         work_to_do     = prepareLinksForDeletion(related_profas)
@@ -186,9 +214,13 @@ if __name__ == '__main__':
             debughelpers.debugJS(work_to_do)
         elif args['remove']:
             deleteOldLinks(sapi, work_to_do)
+        results += [ dict(action = 'delete', **thing) for thing in work_to_do ]
 
     if args.get('debug',False):
         debughelpers.debugJS(work_to_do)
 
+    result_writer.writeRows(results, args['jsoutfile'], args['outformat'])
+
+    sapi.printStats()
     sapi.saveCache()
 
@@ -3,11 +3,14 @@
 # remove all of a user's suggested pubs
 
 import re
+import concurrent.futures
 import urllib.parse
 import sympl_api_highlevel
 import debughelpers
 import sys
 import csvloader
+import result_writer
+import doi_index
 
 # I loathe parseargs, sorry:
 def readArgs():
@@ -31,10 +34,19 @@ def readArgs():
             i += 1
             arg = sys.argv[i]
             args['jsoutfile'] = arg
+        elif re.match(r'-of',arg):
+            i += 1
+            arg = sys.argv[i]
+            args['outformat'] = result_writer.parseFormat(arg)
         elif re.match(r'-pw',arg):
             i += 1
             arg = sys.argv[i]
             args['credfile'] = arg
+        elif re.match(r'-api',arg):
+            args['pubsviaapi'] = True
+        elif re.match(r'-rdb',arg):
+            i += 1
+            args.setdefault('reportfiles', []).append(sys.argv[i])
         elif re.search(r'\@',arg):
             args['users'].append(arg)
 
@@ -46,9 +58,20 @@ def readArgs():
     if 'credfile' not in args:
         args['credfile'] = 'cdl_config.json'
     if 'cachefile' not in args:
-        args['cachefile'] = 'fetch_cache.json'
+        args['cachefile'] = 'fetch_cache.sqlite'
     if 'fake' not in args:
         args['fake'] = False
+    if 'pubsviaapi' not in args:
+        args['pubsviaapi'] = False
+    if 'reportfiles' not in args:
+        args['reportfiles'] = [
+            '../reporting/raw/20170911/lbl_unclaimed_report.tsv',
+            '../reporting/raw/20170911/lbl_pub_report.tsv',
+        ]
+    if 'doiindexfile' not in args:
+        args['doiindexfile'] = 'doi_index.sqlite'
+    if 'outformat' not in args:
+        args['outformat'] = 'json'
 
     return args
 
@@ -57,6 +80,9 @@ def getHelp():
 
 rejector2.py  [ -i  <csv file with things to reject ]
               [ -jr <json_result_file_name> ]
+              [ -of <format> ]
+              [ -rdb <reporting_export.tsv> ... ]
+              [ -api ]
               [ -pw <cred_file_name> ]
               [ -fake ]
               [ -debug ]
@@ -75,6 +101,17 @@ database.
   -fake  :  Causes it to look up the necessary bits of information,
             but not actually make any changes
 
+  -of    :  Format of the result file: json (the default), jsonl,
+            csv or tsv
+
+  -rdb   :  A reporting database export (TSV with system_id and doi
+            columns) to find pubs by DOI in. May be given more than
+            once. The exports are indexed into doi_index.sqlite, which
+            is only rebuilt when one of them changes.
+
+  -api   :  Find the DOIs of the users' pending pubs through the API
+            instead of the reporting database exports
+
   -debug :  Turns on debugspew
 
   -help  :  Print this message
@@ -85,19 +122,34 @@ database.
 
 
 
+# Gathers the pending links of every user, lookup_workers users at a
+# time, into one { (user, pubid): linkid } index, adding each user's
+# links as they come in. Only the index and each user's
+# 'pending_count' are kept, not the links themselves.
 def elaboratePendingLinks(sapi, users):
     print('elaboratePendingLinks()')
-    count = 0;
-    for user in users:
-        count += 1
-        if 'pending_links' not in users[user]:
-            users[user]['pending_links'] = {}
 
-        eid = users[user].get('elements_id',None)
-        if eid:
-            user_pending_links = sapi.getListOfPendingRelationships(eid)
+    def harvest(user):
+        return sapi.getListOfPendingRelationships(users[user]['elements_id'])
+
+    pending_by_pub = {}
+    with concurrent.futures.ThreadPoolExecutor(max_workers = sapi.lookup_workers) as ex:
+        harvests = { ex.submit(harvest, user): user
+                     for user in users if users[user].get('elements_id',None) }
+        for f in concurrent.futures.as_completed(harvests):
+            user = harvests[f]
+            try:
+                user_pending_links = f.result()
+            except sympl_api_highlevel.FetchError as e:
+                print('Could not get pending links for: ' + user)
+                print(e)
+                users[user]['pending_failed'] = e.reason
+                continue
+            users[user]['pending_count'] = len(user_pending_links)
             for link_id in user_pending_links:
-                users[user]['pending_links'][link_id] = user_pending_links[link_id]
+                pubid = user_pending_links[link_id]['related']['id']
+                pending_by_pub[(user, pubid)] = link_id
+    return pending_by_pub
 
 
 def deletePendingLinks(sapi, users):
@@ -124,7 +176,12 @@ def sortInputData(ind):
 def getUserIDs(sapi, users):
     print('getUserIDs()')
     for user in users:
-        uid = sapi.obtainUserID(user)
+        try:
+            uid = sapi.obtainUserID(user)
+        except sympl_api_highlevel.FetchError as e:
+            print('Could not look up user id for: ' + user)
+            print(e)
+            continue
         if uid is not None:
             users[user]['elements_id'] = uid
         else:
@@ -132,69 +189,81 @@ def getUserIDs(sapi, users):
     return users
 
 
-def getPubsDataViaAPI(sapi, users):
+# The DOIs of the pubs, as { pubid: doi }. Each distinct pub is looked
+# up once, lookup_workers at a time, and the cache is saved every
+# save_every lookups.
+def getPubsDataViaAPI(sapi, pubids, save_every = 500):
     print('getPubsDataViaAPI()')
-    pubsdata = {}
-    for user in users:
-        print("User: " + user)
-        for pending_link in users[user]['pending_links']:
-            pubid = users[user]['pending_links'][pending_link]['related']['id']
-            if pubid not in pubsdata:
-                print('.')
-                pubdata = sapi.getPubDetails(pubid)
-                if 'doi' in pubdata:
-                    pubsdata[pubid] = pubdata['doi']
-            else:
-                print('+')
-        sapi.saveCache()
-    return pubsdata
+    pubids = list(dict.fromkeys(pubids))
+    print('-info- looking up {0} distinct pubs'.format(len(pubids)))
 
+    def lookup(pubid):
+        try:
+            return sapi.getPubDetails(pubid)
+        except sympl_api_highlevel.FetchError as e:
+            print(e)
+            return None
 
-def invertPendings(users):
-    print('invertPendings()')
-    for user in users:
-        if not 'pending_links_by_pub' in users[user]:
-            users[user]['pending_links_by_pub'] = {}
+    pubsdata = {}
+    failed = 0
+    with concurrent.futures.ThreadPoolExecutor(max_workers = sapi.lookup_workers) as ex:
+        for n, (pubid, pubdata) in enumerate(zip(pubids, ex.map(lookup, pubids))):
+            if pubdata is None:
+                failed += 1
+            elif 'doi' in pubdata:
+                pubsdata[pubid] = pubdata['doi']
+            if (n + 1) % save_every == 0:
+                sapi.saveCache()
+    sapi.saveCache()
+    if failed:
+        print('-warn- could not look up {0} pubs'.format(failed))
+    return pubsdata
 
-        for linkid in users[user]['pending_links']:
-            pubid = users[user]['pending_links'][linkid]['related']['id']
-            users[user]['pending_links_by_pub'][pubid] = linkid
 
-def getPubsDataViaReportingDB(files):
+# an index of the exports' DOIs that can be used in place of the
+# { doi: system_id } dict findRejectables takes
+def getPubsDataViaReportingDB(files, index_file = 'doi_index.sqlite'):
     print('getPubsDataViaReportingDB()')
-    pubsdata = {}
-    for fn in files:
-        fdata = csvloader.load(fn,'tsv')
-        for row in fdata:
-            sid = row.get('system_id',None)
-            doi = row.get('doi',None)
-            if sid and doi:
-                pubsdata[sid] = doi
-    return pubsdata
+    return doi_index.DOIIndex(index_file, files)
 
 
+# also normalizes the DOIs, so pass it { pubid: doi }
 def invertKVs(d):
     od = {}
     for k, v in d.items():
-        od[v] = k
+        od[sympl_api_highlevel.normalizeDOI(v)] = k
     return od
 
 
-def findRejectables(users, pubs_by_doi):
+def rejectRequestRows(users):
+    for user in users:
+        for rej_req in users[user]['reject_requests']:
+            row = { 'user': user, 'elements_id': users[user].get('elements_id') }
+            row.update(rej_req)
+            yield row
+
+
+# joins the reject requests to the pending links, going from each
+# request's DOI to a pubid through pubs_by_doi, and from the user and
+# pubid to a link through pending_by_pub (see elaboratePendingLinks)
+def findRejectables(users, pending_by_pub, pubs_by_doi):
     print('findRejectables()')
     rejectables = []
+    requests = 0
     for user in users:
         for rej_req in users[user]['reject_requests']:
+            requests += 1
             doi = rej_req.get('doi',None)
             if doi is not None:
-                pubid = pubs_by_doi.get(doi,None)
+                pubid = pubs_by_doi.get(sympl_api_highlevel.normalizeDOI(doi),None)
                 if pubid and len(pubid):
                     rej_req['pubid'] = pubid
-                    linkid = users[user]['pending_links_by_pub'].get(pubid,None)
+                    linkid = pending_by_pub.get((user, pubid),None)
                     if linkid:
                         rej_req['linkid'] = linkid
-                        users[user]['pending_links'][linkid]['user_requested_rejection'] = True
                         rejectables.append(linkid)
+    print('-info- {0} of {1} reject requests match one of {2} pending links'.format(
+          len(rejectables), requests, len(pending_by_pub)))
     return rejectables
 
 
@@ -213,24 +282,30 @@ if __name__ == '__main__':
 
     getUserIDs(sapi, users)
 
-    elaboratePendingLinks(sapi, users)
-
-    invertPendings(users)
+    pending_by_pub = elaboratePendingLinks(sapi, users)
 
-    #pubsdata = getPubsDataViaAPI(sapi, users)
-    pubsdata = getPubsDataViaReportingDB([
-        '../reporting/raw/20170911/lbl_unclaimed_report.tsv',
-        '../reporting/raw/20170911/lbl_pub_report.tsv',])
-    pubs_by_doi = invertKVs(pubsdata)
+    if args['pubsviaapi']:
+        pubids = [ pubid for _, pubid in pending_by_pub ]
+        pubs_by_doi = invertKVs(getPubsDataViaAPI(sapi, pubids))
+    else:
+        pubs_by_doi = getPubsDataViaReportingDB(args['reportfiles'], args['doiindexfile'])
 
-    rejectables = findRejectables(users, pubs_by_doi)
+    rejectables = findRejectables(users, pending_by_pub, pubs_by_doi)
 
     if not args['fake']:
         print('-info- running actions')
         deletePendingLinks(sapi, users)
 
-    debughelpers.dumpJS(users,args['jsoutfile'])
+    # json keeps each user's requests, with the links they matched, and
+    # how many links were pending; the row formats get one row per
+    # reject request
+    if args['outformat'] == 'json':
+        debughelpers.dumpJS(users,args['jsoutfile'])
+    else:
+        result_writer.writeRows(rejectRequestRows(users), args['jsoutfile'],
+                                args['outformat'])
 
+    sapi.printStats()
     sapi.saveCache()
 
     sys.exit()
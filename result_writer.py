@@ -0,0 +1,217 @@
+#!/usr/local/bin/python3
+
+# ****
+# Lawrence Berkeley National Lab
+#
+# Writers that put result rows on disk as they are produced, rather
+# than collecting a whole run's worth and writing it at the end. Each
+# offers
+#
+#   write(row)     append one row (a dict)
+#   flush()        push what has been written so far to disk
+#   close()        finish the file
+#
+# and can be used as a context manager. openWriter picks one by the
+# name of its format, as given to the tools' -of option:
+#
+#   csv, tsv       one line per row, under a header of column names
+#   json           a JSON array of the rows
+#   jsonl          JSON Lines: one JSON object per line
+# ****
+
+import csv
+import json
+
+FORMATS = [ 'csv', 'tsv', 'json', 'jsonl' ]
+
+# how many rows a CSV writer with no declared columns looks at to
+# decide what its columns are
+DEFAULT_INFER_ROWS = 100
+
+
+# turn something into a string one way or another. Dicts get json'd
+# arrays that contains only strings get joined with commas, otherwise
+# they get json'd, too, and everything else gets to just be a str
+def stringify(thing):
+    ostr = ''
+    if isinstance(thing,list) or isinstance(thing,tuple):
+        nonstrings = False
+        for elem in thing:
+            if not isinstance(elem,str):
+                nonstrings = True
+                break;
+        if nonstrings:
+            ostr = json.dumps(thing)
+        else:
+            ostr = ', '.join(thing)
+
+    elif isinstance(thing,dict):
+        ostr = json.dumps(thing)
+    else:
+        ostr = str(thing)
+
+    return ostr
+
+
+def openWriter(fmt, fn, colnames = None):
+    if fmt == 'csv':
+        return CSVRowWriter(fn, colnames)
+    if fmt == 'tsv':
+        return CSVRowWriter(fn, colnames, 'tsv')
+    if fmt == 'json':
+        return JSONArrayWriter(fn)
+    if fmt == 'jsonl':
+        return JSONLinesWriter(fn)
+    raise ValueError('unknown output format: ' + str(fmt))
+
+
+# writes every row of rows to fn in the given format
+def writeRows(rows, fn, fmt, colnames = None):
+    with openWriter(fmt, fn, colnames) as w:
+        for row in rows:
+            w.write(row)
+
+
+# reads an -of argument naming one format
+def parseFormat(arg):
+    fmt = arg.strip().lower()
+    if fmt not in FORMATS:
+        raise ValueError('unknown output format: ' + fmt +
+                         ' (choose from ' + ', '.join(FORMATS) + ')')
+    return fmt
+
+# reads an -of argument that may name several, separated by commas
+def parseFormats(arg):
+    return [ parseFormat(f) for f in arg.split(',') if len(f.strip()) ]
+
+
+# CSV (or TSV) rows under a header of column names, with values turned
+# into strings by stringify and columns a row does not have left
+# empty. If colnames is not given, the columns are every key seen in
+# the first infer_rows rows, in the order they were first seen; those
+# rows are held back until then. Keys that only turn up later are not
+# written, and are reported once when the file is closed. Keys not
+# among declared colnames are left out without comment.
+class CSVRowWriter:
+
+    def __init__(self, fn, colnames = None, dialectname = None,
+                 infer_rows = DEFAULT_INFER_ROWS):
+        self.fh = open(fn,'w')
+        self.fn = fn
+        if dialectname == 'tsv':
+            self.writer = csv.writer(self.fh, dialect=csv.excel_tab)
+        else:
+            self.writer = csv.writer(self.fh)
+        self.infer_rows = infer_rows
+        self.held = []
+        self.unwritten = {}
+        self.inferred = False
+        self.colnames = None
+        if colnames is not None:
+            self._start(colnames)
+
+    def _start(self, colnames):
+        self.colnames = list(colnames)
+        self.known = set(self.colnames)
+        self.writer.writerow(self.colnames)
+
+    def _infer(self):
+        ch = {}
+        for row in self.held:
+            for k in row.keys():
+                ch[k] = True
+        self._start(ch.keys())
+        self.inferred = True
+        held = self.held
+        self.held = []
+        for row in held:
+            self._write(row)
+
+    def _write(self, row):
+        if self.inferred:
+            for k in row.keys():
+                if k not in self.known:
+                    self.unwritten[k] = True
+        self.writer.writerow([ stringify(row.get(x,'')) for x in self.colnames ])
+
+    def write(self, row):
+        if self.colnames is None:
+            self.held.append(row)
+            if len(self.held) >= self.infer_rows:
+                self._infer()
+        else:
+            self._write(row)
+
+    def flush(self):
+        self.fh.flush()
+
+    def close(self):
+        if self.fh is not None:
+            if self.colnames is None:
+                self._infer()
+            self.fh.close()
+            self.fh = None
+            if len(self.unwritten):
+                print('-warn- columns first seen after row ' + str(self.infer_rows) +
+                      ' were left out of ' + self.fn + ': ' + ', '.join(self.unwritten))
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+# a JSON array of the rows, laid out as debughelpers.dumpJS would lay
+# out the whole list, but written one element at a time
+class JSONArrayWriter:
+
+    def __init__(self, fn):
+        self.fh = open(fn,'w')
+        self.count = 0
+
+    def write(self, row):
+        text = json.dumps(row,indent=2,sort_keys=True)
+        self.fh.write(',\n' if self.count else '[\n')
+        self.fh.write('  ' + text.replace('\n', '\n  '))
+        self.count += 1
+
+    def flush(self):
+        self.fh.flush()
+
+    def close(self):
+        if self.fh is not None:
+            self.fh.write('\n]' if self.count else '[]')
+            self.fh.close()
+            self.fh = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+# one compact JSON object per line, which other tools can read a row
+# at a time
+class JSONLinesWriter:
+
+    def __init__(self, fn):
+        self.fh = open(fn,'w')
+
+    def write(self, row):
+        self.fh.write(json.dumps(row,sort_keys=True) + '\n')
+
+    def flush(self):
+        self.fh.flush()
+
+    def close(self):
+        if self.fh is not None:
+            self.fh.close()
+            self.fh = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
@@ -13,28 +13,168 @@
 
 
 import re
+import os
+import json
+import time
 import urllib.parse
+import asyncio
+import concurrent.futures
 import sympl_api_lowlevel as fapi
 import debughelpers
 
-class Paginator:
-    def __init__(self):
-        self.curr = 1
-        self.last = -1
-
-    def more(self):
-        return self.curr != self.last
-
-    def current(self):
-        return self.curr
-
-    def update(self,data):
-        pagination = data['feed']['pagination']
-        for page in pagination['page']:
-            if page['@position'] == 'last':
-                self.last = int(page['@number'])
-                if self.curr != self.last:
-                    self.curr += 1
+# raised by any lookup or post whose request could not be completed,
+# as opposed to one that completed and found nothing
+FetchError = fapi.FetchError
+
+# reads the number of the last page out of a paginated feed. A feed
+# without pagination info is treated as a single page.
+def lastPageNumber(data):
+    try:
+        pages = data['feed']['pagination']['page']
+    except Exception as e:
+        return 1
+
+    if isinstance(pages, dict):
+        pages = [ pages ]
+
+    for page in pages:
+        if page.get('@position') == 'last':
+            return int(page['@number'])
+    return 1
+
+
+
+# the grant fields loadGrantData keeps
+GRANT_FIELDS = ['funder-name','funder-reference']
+
+# bump this if the layout of the grant snapshot file changes
+GRANT_SNAPSHOT_VERSION = 2
+
+# seconds the grant snapshot's sync time is set back by, to allow for
+# our clock running ahead of the server's
+GRANT_SYNC_MARGIN = 600
+
+
+# Runs of plain text that any string a regex matches must contain,
+# used to narrow a regex grant search. Anything whose meaning is not
+# obvious at a glance (alternation, groups) gives no literals, which
+# just means no narrowing.
+def requiredLiterals(regex):
+    if '|' in regex or '(' in regex:
+        return []
+    # escapes and character classes do not stand for fixed text
+    s = re.sub(r'\\.', '\0', regex)
+    s = re.sub(r'\[[^\]]*\]', '\0', s)
+    # a character that may repeat zero times is not required, and a
+    # counted repeat is not worth working out
+    s = re.sub(r'.\{[^}]*\}', '\0', s)
+    s = re.sub(r'.[?*]', '\0', s)
+    runs = re.split(r'[\0.^$+?*{}\[\]]', s)
+    return [ run for run in runs if len(run) >= 3 ]
+
+
+# Projections used by the lookups below; see fapi.Projection. Each one
+# pulls just a handful of values out of an entry element.
+
+# the captured native fields of a grant, from its source-3 record if
+# it has more than one
+def grantFieldsProjection(fields_to_capture):
+    wanted = set(fields_to_capture)
+
+    def extract(entry):
+        obj = entry.find('object')
+        records = obj.findall('records/record')
+        record = records[0]
+        for subrecord in records:
+            if subrecord.get('source-name') == 'source-3':
+                record = subrecord
+                break
+
+        fields = {}
+        for field in record.findall('native/field'):
+            fname = field.get('name')
+            if fname in wanted:
+                fields[fname] = fapi.elementValue(field.find('text'))
+        return { 'id': obj.get('id'), 'fields': fields }
+
+    return fapi.Projection('grantfields:' + ','.join(sorted(wanted)), extract)
+
+
+# some of the bibliographic information for a publication, taken from
+# its first record. This is by no means comprehensive. There is a lot
+# of info available per publication in the database, and some of it
+# varies with pub type. This just pulls a few interesting fields
+def extractPubDetails(entry):
+    obj = entry.find('object')
+
+    pdata = {}
+
+    rtype = obj.get('type')
+    if rtype is not None:
+        pdata['type'] = rtype
+
+    # only reported when the journal has more than one record
+    journal_records = obj.findall('journal/records/record')
+    if len(journal_records) > 1:
+        jtitle = journal_records[0].find('title')
+        if jtitle is not None:
+            pdata['journal'] = fapi.elementValue(jtitle)
+
+    # a pub can have come from more than one source nad have more 
+    # than one record. Just use the first for now.
+    record = obj.find('records/record')
+
+    for field in record.findall('native/field'):
+        field_name = field.get('name')
+        if field_name in ['author-url', 'title', 'abstract', 'volume',
+                          'eissn', 'issn', 'journal', 'issue', 'doi']:
+            text = field.find('text')
+            if text is not None:
+                pdata[field_name] = fapi.elementValue(text)
+        elif field_name == 'publication-date':
+            d = []
+            for t in ['year','month','day']:
+                part = field.find('date/' + t)
+                if part is not None:
+                    d.append(fapi.elementValue(part))
+            pdata['pub_date'] = '/'.join(d)
+        elif field_name == 'pagination':
+            begin = field.find('pagination/begin-page')
+            if begin is not None:
+                pdata['pages'] = {
+                    'from': fapi.elementValue(begin),
+                    'to': fapi.elementValue(begin)
+                }
+
+    return pdata
+
+PUB_DETAILS = fapi.Projection('pubdetails', extractPubDetails)
+
+
+# DOIs are case-insensitive, so they are compared lowercased
+def normalizeDOI(doi):
+    return doi.strip().lower()
+
+
+# a search hit's id, type and title, and every DOI any of its records
+# gives it
+def extractPubDOIs(entry):
+    obj = entry.find('object')
+    title = entry.find('title')
+    dois = set()
+    for field in obj.findall('records/record/native/field'):
+        if field.get('name') == 'doi':
+            text = field.findtext('text')
+            if text:
+                dois.add(normalizeDOI(text))
+    return {
+        'id':    obj.get('id'),
+        'type':  obj.get('type'),
+        'title': fapi.elementValue(title) if title is not None else None,
+        'dois':  sorted(dois),
+    }
+
+PUB_DOIS = fapi.Projection('pubdois', extractPubDOIs)
 
 
 
@@ -44,10 +184,46 @@ class SymplecticAPI:
         fetcher = fapi.VerySimpleCachedFetcher(args)
         fetcher.load()
         self.fetcher = fetcher
+        self.afetcher = fapi.AsyncCachedFetcher(fetcher)
         self.grantData = None
         self.relationTypeData = None
+        self.page_workers = int(args.get('pageworkers',
+                                fetcher.config.get('page_workers', 4)))
+        self.lookup_workers = int(fetcher.config.get('lookup_workers', 8))
+        self.write_workers = int(fetcher.config.get('write_workers', 4))
+        self.write_rate = float(fetcher.config.get('write_rate', 5))
         self.inited = True
 
+    # fetches every page of a paginated listing. make_url takes a page
+    # number and returns the url for it. The first page tells us where
+    # the last one is, and pages 2..N are then fetched concurrently with
+    # at most page_workers requests in flight. Returns the data of each
+    # page, in page order.
+    def _fetchAllPages(self, make_url, projection = None, use_cache = True):
+        first = self.fetcher.fetch(make_url(1), projection = projection,
+                                   use_cache = use_cache)
+        last = lastPageNumber(first)
+        if last <= 1:
+            return [ first ]
+
+        workers = max(1, min(self.page_workers, last - 1))
+        with concurrent.futures.ThreadPoolExecutor(max_workers = workers) as ex:
+            rest = ex.map(lambda page: self.fetcher.fetch(make_url(page),
+                                                          projection = projection,
+                                                          use_cache = use_cache),
+                          range(2, last + 1))
+            return [ first ] + list(rest)
+
+    # awaitable version of the above; all of pages 2..N are put in
+    # flight at once and the async fetcher's semaphore bounds them
+    async def _fetchAllPagesAsync(self, make_url, projection = None):
+        first = await self.afetcher.fetch(make_url(1), projection = projection)
+        last = lastPageNumber(first)
+        rest = await asyncio.gather(*[ self.afetcher.fetch(make_url(page),
+                                                           projection = projection)
+                                       for page in range(2, last + 1) ])
+        return [ first ] + list(rest)
+
 
     def post(self, url_rest, data, topname):
         return self.fetcher.post(url_rest, data, topname)
@@ -56,21 +232,45 @@ class SymplecticAPI:
         return self.fetcher.delete(url_rest)
 
 
+    async def postAsync(self, url_rest, data, topname):
+        return await self.afetcher.post(url_rest, data, topname)
+
+    async def deleteAsync(self, url_rest):
+        return await self.afetcher.delete(url_rest)
+
+
     def removePending(self, relid):
         url = 'suggestions/relationships/' + str(relid)
         return self.delete(url)
 
+    async def removePendingAsync(self, relid):
+        url = 'suggestions/relationships/' + str(relid)
+        return await self.deleteAsync(url)
+
 
     def getUserInfo(self, uid):
         url = 'users/' + uid
         data = self.fetcher.fetch(url)
         return data
 
+    async def getUserInfoAsync(self, uid):
+        url = 'users/' + uid
+        return await self.afetcher.fetch(url)
+
     # takes an email address, returns the system user id for that person,
     # if it exists
     def obtainUserID(self, email):
-        url = 'users?' + urllib.parse.urlencode({'username':email})
-        data = self.fetcher.fetch(url)
+        data = self.fetcher.fetch(self._userIDURL(email))
+        return self._parseUserID(data)
+
+    async def obtainUserIDAsync(self, email):
+        data = await self.afetcher.fetch(self._userIDURL(email))
+        return self._parseUserID(data)
+
+    def _userIDURL(self, email):
+        return 'users?' + urllib.parse.urlencode({'username':email})
+
+    def _parseUserID(self, data):
         debughelpers.debugJS(data)
         userid = None
         try:
@@ -83,63 +283,57 @@ class SymplecticAPI:
         return userid 
 
 
-    def __getListOfGrants(self,fields_to_capture):
-        pg = Paginator()
+    # all grants, or with modified_since (an ISO 8601 time) only those
+    # changed since then. This always goes to the server, since the
+    # result is kept in the grant snapshot rather than the fetch cache.
+    def __getListOfGrants(self,fields_to_capture, modified_since = None):
         items_per_page = 25
 
-        grants = {}
-        while pg.more():
-            url = 'grants?' + urllib.parse.urlencode({
+        def make_url(page):
+            params = {
                 'detail': 'full',
                 'per-page': items_per_page,
-                'page': pg.current(),
-            })
-            data = self.fetcher.fetch(url)
-
-            for entry in data['feed']['entry']:
-                # debughelpers.debugJS(entry)
-                obj = entry['object']
-                record = obj['records']['record']
-
-                if isinstance(record,list):
-                    for subrecord in record:
-                        if subrecord['@source-name'] == 'source-3':
-                            record = subrecord
-                            break
-
-                grantid = obj['@id']
+                'page': page,
+            }
+            if modified_since is not None:
+                params['modified-since'] = modified_since
+            return 'grants?' + urllib.parse.urlencode(params)
 
+        grants = {}
+        for data in self._fetchAllPages(make_url, grantFieldsProjection(fields_to_capture),
+                                        use_cache = False):
+            for entry in data['feed'].get('entry', []):
+                grantid = entry['id']
                 if grantid not in grants:
                     grants[grantid] = {}
-                for field in record['native']['field']:
-                    fname = field['@name']
-                    if fname in fields_to_capture:
-                        fval = field['text']
-                        grants[grantid][fname] = fval
+                grants[grantid].update(entry['fields'])
 
-
-            pg.update(data)
-           
         # print(grants)
         return grants
 
 
     def getUsersProfessionalActivityRelationships(self,uid):
-        pg = Paginator()
-        items_per_page = 25
-        related_profas = {}
-        while pg.more():
-            url = 'users/' + uid + '/relationships?' + urllib.parse.urlencode({
-                '@category': 'activity',
-                'page': pg.current(),
-            })
-            data = self.fetcher.fetch(url)
+        pages = self._fetchAllPages(lambda page: self._profasURL(uid, page))
+        return self._parseProfas(pages)
+
+    async def getUsersProfessionalActivityRelationshipsAsync(self,uid):
+        pages = await self._fetchAllPagesAsync(lambda page: self._profasURL(uid, page))
+        return self._parseProfas(pages)
+
+    def _profasURL(self, uid, page):
+        return 'users/' + uid + '/relationships?' + urllib.parse.urlencode({
+            '@category': 'activity',
+            'page': page,
+        })
 
+    def _parseProfas(self, pages):
+        related_profas = {}
+        for data in pages:
             entries = []
             try:
                 entries = data['feed']['entry']
             except Exception as e:
-                return related_profas 
+                continue
 
             if isinstance(entries,dict):
                 entries = [ entries ]
@@ -155,29 +349,36 @@ class SymplecticAPI:
                     debughelpers.debugJS(relationship)
                     related_profas[rel_id] = relationship
 
-            pg.update(data)
         return related_profas
 
 
 
 
     def getListOfPubsQuery(self,q):
-        pg = Paginator()
-        items_per_page = 25
-
+        pages = self._fetchAllPages(lambda page: self._pubsQueryURL(q, page))
+        return self._parsePubsQuery(pages)
+
+    async def getListOfPubsQueryAsync(self,q):
+        pages = await self._fetchAllPagesAsync(lambda page: self._pubsQueryURL(q, page))
+        return self._parsePubsQuery(pages)
+
+    def _pubsQueryURL(self, q, page, detail = None):
+        params = {
+            'query': q,
+            'page': page,
+        }
+        if detail is not None:
+            params['detail'] = detail
+        return 'publications?' + urllib.parse.urlencode(params)
+
+    def _parsePubsQuery(self, pages):
         pubids = {}
-        while pg.more():
-            url = 'publications?' + urllib.parse.urlencode({
-                'query': q,
-                'page': pg.current(),
-            })
-
-            data = self.fetcher.fetch(url)
+        for data in pages:
             entries = []
             try:
                 entries = data['feed']['entry']
             except Exception as e:
-                return pubids
+                continue
 
             if isinstance(entries,dict):
                 entries = [ entries ]
@@ -192,15 +393,76 @@ class SymplecticAPI:
                         'title': entry.get('title')
                     }
 
-            pg.update(data)
-            
         return pubids
 
 
+    # Resolves many DOIs at once. DOIs are looked up batch_size at a
+    # time with one OR'd search per batch, and the hits are matched back
+    # to the DOIs by their doi fields. A DOI that matches exactly one
+    # pub is settled; anything else (no pub, or several) is looked up on
+    # its own with getListOfPubsQuery, exactly as a single search would
+    # have been. Returns { doi: getListOfPubsQuery-style result }.
+    # If failures (a dict) is given, a DOI whose lookup could not be
+    # completed is left out of the result and its FetchError recorded
+    # there, rather than raised.
+    def resolveDOIs(self, dois, batch_size = None, failures = None):
+        if batch_size is None:
+            batch_size = int(self.fetcher.config.get('doi_batch_size', 20))
+        dois = list(dict.fromkeys(dois))
+
+        results = {}
+        for start in range(0, len(dois), batch_size):
+            batch = dois[start:start + batch_size]
+            q = ' OR '.join([ '"' + doi + '"' for doi in batch ])
+            try:
+                pages = self._fetchAllPages(lambda page: self._pubsQueryURL(q, page, 'full'),
+                                            PUB_DOIS)
+            except FetchError as e:
+                if failures is None:
+                    raise
+                # the DOIs can still be tried one at a time
+                pages = []
+
+            by_doi = {}
+            for data in pages:
+                # a page that is not a feed (an error, or a body that
+                # could not be parsed) has no hits, so its DOIs fall
+                # through to the single searches below
+                feed = data.get('feed') if isinstance(data, dict) else None
+                if not isinstance(feed, dict):
+                    continue
+                for pub in feed.get('entry', []):
+                    for doi in pub['dois']:
+                        by_doi.setdefault(doi, {})[pub['id']] = {
+                            'type':  pub['type'],
+                            'title': pub['title'],
+                        }
+
+            for doi in batch:
+                pubs = by_doi.get(normalizeDOI(doi), {})
+                if len(pubs) == 1:
+                    results[doi] = pubs
+                    continue
+                try:
+                    results[doi] = self.getListOfPubsQuery('"' + doi + '"')
+                except FetchError as e:
+                    if failures is None:
+                        raise
+                    failures[doi] = e
+
+        return results
+
 
-    def getPubRelationships(self, pubid):
+    # use_cache = False asks the server even if a cached copy is fresh
+    def getPubRelationships(self, pubid, use_cache = True):
         url = 'publications/' + str(pubid) + '/relationships'
-        data = self.fetcher.fetch(url)
+        return self._parsePubRelationships(self.fetcher.fetch(url, use_cache = use_cache))
+
+    async def getPubRelationshipsAsync(self, pubid):
+        url = 'publications/' + str(pubid) + '/relationships'
+        return self._parsePubRelationships(await self.afetcher.fetch(url))
+
+    def _parsePubRelationships(self, data):
         # debughelpers.debugJS(data)
 
         try:
@@ -236,24 +498,29 @@ class SymplecticAPI:
 
         
     def getListOfPendingRelationships(self, userid):
-        pg = Paginator()
+        pages = self._fetchAllPages(lambda page: self._pendingURL(userid, page))
+        return self._parsePending(userid, pages)
+
+    async def getListOfPendingRelationshipsAsync(self, userid):
+        pages = await self._fetchAllPagesAsync(lambda page: self._pendingURL(userid, page))
+        return self._parsePending(userid, pages)
+
+    def _pendingURL(self, userid, page):
         items_per_page = 100
+        return ''.join(
+                ['users/',
+                 userid,
+                 '/suggestions/relationships/pending/publications',
+                 '?',
+                 urllib.parse.urlencode({
+                     'per-page': items_per_page,
+                     'page': page,
+                 })
+                ])
 
+    def _parsePending(self, userid, pages):
         pending_links = {}
-        while pg.more():
-            url = ''.join(
-                    ['users/',
-                     userid,
-                     '/suggestions/relationships/pending/publications',
-                     '?',
-                     urllib.parse.urlencode({
-                         'per-page': items_per_page,
-                         'page': pg.current(),
-                     })
-                    ])
-
-            data = self.fetcher.fetch(url)
-
+        for data in pages:
             try:
                 entries = data['feed']['entry']
             except Exception as e:
@@ -280,29 +547,33 @@ class SymplecticAPI:
             except Exception as e:
                 pass
 
-            pg.update(data)
-
         return pending_links
 
 
     # takes the system user id for a person, returns a list of the system
     # id for all the publications associated with that user
     def getListOfUsersPubIDs(self, userid):
-        pg = Paginator()
-        items_per_page = 25
+        pages = self._fetchAllPages(lambda page: self._usersPubsURL(userid, page))
+        return self._parseUsersPubIDs(userid, pages)
 
-        pubs = []
-        while pg.more():
+    async def getListOfUsersPubIDsAsync(self, userid):
+        pages = await self._fetchAllPagesAsync(lambda page: self._usersPubsURL(userid, page))
+        return self._parseUsersPubIDs(userid, pages)
 
-            url = ''.join(
-                ['users/', str(userid),
-                 '/publications?',
-                 urllib.parse.urlencode({
-                     'per-page': items_per_page,
-                     'page': pg.current(),
-                 })
-                ])
-            data = self.fetcher.fetch(url)
+    def _usersPubsURL(self, userid, page):
+        items_per_page = 25
+        return ''.join(
+            ['users/', str(userid),
+             '/publications?',
+             urllib.parse.urlencode({
+                 'per-page': items_per_page,
+                 'page': page,
+             })
+            ])
+
+    def _parseUsersPubIDs(self, userid, pages):
+        pubs = []
+        for data in pages:
             # debughelpers.dumpJS(data, userid)
 
             try:
@@ -325,7 +596,6 @@ class SymplecticAPI:
             except Exception as e:
                 pass
 
-            pg.update(data)
         return pubs
 
 
@@ -337,54 +607,13 @@ class SymplecticAPI:
     # few interesting fields
     def getPubDetails(self,pubid):
         url = 'publications/' + str(pubid)
-        data = self.fetcher.fetch(url)
-        # debughelpers.debugJS(data)
-        obj = data['feed']['entry']['object']
-
-        pdata = {}
-
-        try:
-            rtype = obj['@type']
-            pdata['type'] = rtype 
-        except Exception as e:
-            pass
-
-        try:
-            jtitle = obj['journal']['records']['record'][0]['title']
-            pdata['journal'] = jtitle
-        except Exception as e:
-            pass
-
-        # a pub can have come from more than one source nad have more 
-        # than one record. Just use the first for now.
-        record = obj['records']['record']
-        if type(record) is list:
-            record = record[0]
-
-        fields = record['native']['field']
-        # debughelpers.debugJS(fields)
-
-        for field in fields:
-            field_name = field['@name']
-            if field_name in ['author-url', 'title', 'abstract', 'volume',
-                              'eissn', 'issn', 'journal', 'issue', 'doi']:
-                pdata[field_name] = field['text']
-            elif field_name == 'publication-date':
-                d = []
-                for t in ['year','month','day']:
-                    if t in field['date']:
-                        d.append(field['date'][t])
-                pdata['pub_date'] = '/'.join(d)
-            elif field_name == 'pagination':
-                try:
-                    pdata['pages'] = {
-                        'from': field['pagination']['begin-page'],
-                        'to': field['pagination']['begin-page']
-                    }
-                except Exception as e:
-                    pass
+        data = self.fetcher.fetch(url, projection = PUB_DETAILS)
+        return data['feed']['entry'][0]
 
-        return pdata
+    async def getPubDetailsAsync(self,pubid):
+        url = 'publications/' + str(pubid)
+        data = await self.afetcher.fetch(url, projection = PUB_DETAILS)
+        return data['feed']['entry'][0]
 
     def __getListOfRelationshipTypes(self):
         rids = {};
@@ -398,35 +627,161 @@ class SymplecticAPI:
         return rids
 
 
+    # Besides id -> name, keeps name -> id, and remembers the answer for
+    # each regex findRelationshipTypeIDs is asked about. The id and name
+    # maps are kept in the fetch cache next to the types listing, so a
+    # later run gets them without fetching or parsing anything.
     def loadRelationshipData(self):
         if self.relationTypeData == None:
-            print('-info- fetching relationship types')
-            self.relationTypeData = self.__getListOfRelationshipTypes()
+            key = 'relationship/types#index'
+            index = self.fetcher.getCached(key)
+            if index is None:
+                print('-info- fetching relationship types')
+                by_id = self.__getListOfRelationshipTypes()
+                by_name = {}
+                for relid in by_id:
+                    # like the old linear scan, the first id wins
+                    by_name.setdefault(by_id[relid], relid)
+                index = { 'by_id': by_id, 'by_name': by_name }
+                self.fetcher.putCached(key, index)
+            self.relationTypeData = index['by_id']
+            self.relationTypeIDs = index['by_name']
+            self.relationTypeMatches = {}
 
     def findRelationshipTypeID(self, name):
 
         self.loadRelationshipData()
 
-        for relid in self.relationTypeData:
-            if self.relationTypeData[relid] == name:
-                return relid;
-        return None
+        return self.relationTypeIDs.get(name)
 
 
     def findRelationshipTypeIDs(self, regex):
 
         self.loadRelationshipData()
 
-        relids = []
-        for relid in self.relationTypeData:
-            if re.search(regex,self.relationTypeData[relid]):
-                relids.append(relid)
-        return relids
-
-    def loadGrantData(self):
-        if self.grantData == None:
+        relids = self.relationTypeMatches.get(regex)
+        if relids is None:
+            pattern = re.compile(regex)
+            relids = [ relid for relid in self.relationTypeData
+                       if pattern.search(self.relationTypeData[relid]) ]
+            self.relationTypeMatches[regex] = relids
+        return list(relids)
+
+    # The grant catalogue is kept in a local snapshot file (grantfile,
+    # default grant_snapshot.json) holding just the captured fields and
+    # their exact-match index. At startup the snapshot is read and only
+    # grants modified since it was last synced are asked for. The whole
+    # catalogue is crawled again if there is no usable snapshot or if
+    # a resync is asked for (grantresync). A grant deleted from
+    # Elements only drops out of the snapshot on a resync.
+    def loadGrantData(self, resync = None):
+        if self.grantData != None:
+            return
+        if resync is None:
+            resync = self.args.get('grantresync', False)
+
+        snapshot = None
+        if not resync:
+            snapshot = self._readGrantSnapshot()
+
+        # note the time before asking, so that nothing modified while
+        # we are fetching is missed next time. It is set back by
+        # grant_sync_margin, since our clock may be ahead of the
+        # server's; a grant changed in that window is just fetched
+        # twice, which does no harm.
+        margin = float(self.fetcher.config.get('grant_sync_margin', GRANT_SYNC_MARGIN))
+        synced_at = time.strftime('%Y-%m-%dT%H:%M:%SZ', time.gmtime(time.time() - margin))
+
+        if snapshot is None:
             print('-info- fetching grant data')
-            self.grantData = self.__getListOfGrants(['funder-name','funder-reference'])
+            self.grantData = self.__getListOfGrants(GRANT_FIELDS)
+            self._indexGrants()
+        else:
+            print('-info- refreshing grant data modified since ' + snapshot['synced_at'])
+            self.grantData = snapshot['grants']
+            changed = self.__getListOfGrants(GRANT_FIELDS, snapshot['synced_at'])
+            if len(changed):
+                print('-info- {0} grants changed'.format(len(changed)))
+                for grantid in changed:
+                    self.grantData[grantid] = changed[grantid]
+                self._indexGrants()
+            else:
+                self._indexGrants(snapshot['index'])
+
+        self._writeGrantSnapshot(synced_at)
+
+    def _grantSnapshotFile(self):
+        return self.args.get('grantfile', 'grant_snapshot.json')
+
+    def _readGrantSnapshot(self):
+        fn = self._grantSnapshotFile()
+        if not os.path.exists(fn):
+            return None
+        try:
+            with open(fn,'r') as fh:
+                snapshot = json.load(fh)
+        except Exception as e:
+            print('-warning- could not read grant snapshot ' + fn)
+            print(e)
+            return None
+        if (snapshot.get('version') != GRANT_SNAPSHOT_VERSION or
+            snapshot.get('fields') != GRANT_FIELDS):
+            print('-info- grant snapshot ' + fn + ' is out of date; resyncing')
+            return None
+        return snapshot
+
+    def _writeGrantSnapshot(self, synced_at):
+        fn = self._grantSnapshotFile()
+        snapshot = {
+            'version':   GRANT_SNAPSHOT_VERSION,
+            'fields':    GRANT_FIELDS,
+            'synced_at': synced_at,
+            'grants':    self.grantData,
+            'index':     self.grantIndex,
+        }
+        try:
+            # write then rename, so an interrupted run cannot leave a
+            # half-written snapshot behind
+            with open(fn + '.tmp','w') as fh:
+                fh.write(json.dumps(snapshot))
+            os.replace(fn + '.tmp', fn)
+        except Exception as e:
+            print('-warning- could not write grant snapshot ' + fn)
+            print(e)
+
+    # value -> [grantids] for each captured field, so an exact match is
+    # a single probe. A saved copy of the index can be passed in. The
+    # trigram indexes used for regex matching are only built if a regex
+    # search is actually made.
+    def _indexGrants(self, index = None):
+        self.grantOrder = {}
+        self.grantTrigrams = {}
+        for grantid in self.grantData:
+            self.grantOrder[grantid] = len(self.grantOrder)
+
+        if index is not None:
+            self.grantIndex = index
+            return
+
+        self.grantIndex = {}
+        for field in GRANT_FIELDS:
+            self.grantIndex[field] = {}
+        for grantid in self.grantData:
+            for field in GRANT_FIELDS:
+                # an empty <text/> comes back as None
+                fval = self.grantData[grantid].get(field) or ''
+                self.grantIndex[field].setdefault(fval, []).append(grantid)
+
+    def _grantTrigrams(self, fieldname):
+        trigrams = self.grantTrigrams.get(fieldname)
+        if trigrams is None:
+            trigrams = {}
+            for grantid in self.grantData:
+                fval = self.grantData[grantid].get(fieldname) or ''
+                for i in range(len(fval) - 2):
+                    trigrams.setdefault(fval[i:i+3], set()).add(grantid)
+            self.grantTrigrams[fieldname] = trigrams
+        return trigrams
 
     def getGrantName(self,grantid):
 
@@ -438,23 +793,40 @@ class SymplecticAPI:
 
         return None
 
-    def findGrantsMatching(self, regex,fieldname):
+    # grants whose fieldname is exactly regex or, with exact = False,
+    # which regex matches (re.search). For a regex, only grants holding
+    # every trigram of the pattern's required literal text are tried.
+    def findGrantsMatching(self, regex,fieldname, exact = True):
 
         self.loadGrantData()
 
-        res = []
-        for grantid in self.grantData:
-            fval = self.grantData[grantid].get(fieldname,'')
-            require_exact_match = True
-            if require_exact_match:
-                if regex == fval:
-                    res.append(grantid)
-            else:
-                m = re.search(regex,fval)
-                if m:
-                    res.append(grantid)
+        if fieldname not in self.grantIndex:
+            # not a captured field, so every grant has it as ''
+            if (regex == '') if exact else re.search(regex, ''):
+                return list(self.grantData.keys())
+            return []
+
+        if exact:
+            return list(self.grantIndex[fieldname].get(regex, []))
+
+        candidates = None
+        trigrams = self._grantTrigrams(fieldname)
+        for literal in requiredLiterals(regex):
+            for i in range(len(literal) - 2):
+                have = trigrams.get(literal[i:i+3], set())
+                candidates = have if candidates is None else candidates & have
+        if candidates is None:
+            candidates = self.grantData.keys()
+
+        pattern = re.compile(regex)
+        res = [ grantid for grantid in candidates
+                if pattern.search(self.grantData[grantid].get(fieldname) or '') ]
+        res.sort(key = lambda grantid: self.grantOrder[grantid])
         return res
 
     def saveCache(self):
         self.fetcher.save()
 
+    def printStats(self):
+        self.fetcher.reportStats()
+
@@ -12,25 +12,321 @@
 # ****
 
 import requests
+import requests.adapters
 import xml.etree.ElementTree as etree
 from io import StringIO
 import json
-from collections import defaultdict
+import re
+import threading
+import time
+import asyncio
+import concurrent.futures
+import email.utils
+import random
+import urllib3.exceptions
 import d2xml
+import fetch_cache
+import work_pool
+
+# how long cached responses stay good, in seconds. The first pattern
+# that matches a url wins; anything unmatched gets DEFAULT_CACHE_TTL.
+# Both can be overridden with 'cache_ttls' and 'cache_default_ttl' in
+# the config file.
+DEFAULT_CACHE_TTLS = [
+    [ r'^relationship/types',                 30 * 24 * 3600 ],
+    [ r'^grants\?',                            7 * 24 * 3600 ],
+    [ r'^users\?',                             7 * 24 * 3600 ],
+    [ r'/suggestions/relationships/pending',           3600 ],
+    [ r'/relationships',                               3600 ],
+]
+DEFAULT_CACHE_TTL = 24 * 3600
+
+# once the cache holds more than this many entries, the least recently
+# used tenth of them is dropped
+DEFAULT_CACHE_MAX_ENTRIES = 200000
+
+# returned by _fetch when a conditional GET comes back 304
+NOT_MODIFIED = object()
+
+# statuses worth trying again. A POST is only retried on the ones that
+# mean the server turned it away without acting on it.
+RETRY_STATUSES = (429, 500, 502, 503, 504)
+RETRY_STATUSES_POST = (429, 503)
+
+
+# raised when a request could not be completed, after whatever retries
+# it was allowed. This is never a "not found": the server did not give
+# an answer either way.
+class FetchError(Exception):
+
+    def __init__(self, method, url, reason, attempts):
+        super().__init__('{0} {1} failed after {2} attempt(s): {3}'.format(
+                         method, url, attempts, reason))
+        self.method = method
+        self.url = url
+        self.reason = reason
+        self.attempts = attempts
+
+
+# seconds to wait from a Retry-After header, which may be a number of
+# seconds or an HTTP date; None if there is no usable value
+def parseRetryAfter(value):
+    if not value:
+        return None
+    try:
+        return max(0.0, float(value))
+    except ValueError:
+        pass
+    try:
+        when = email.utils.parsedate_to_datetime(value)
+        return max(0.0, when.timestamp() - time.time())
+    except Exception as e:
+        return None
+
+
+# True if a request failed before it could have reached the server, so
+# that even a POST is safe to send again
+def neverSent(e):
+    if isinstance(e, requests.exceptions.ConnectTimeout):
+        return True
+    if isinstance(e, requests.exceptions.ConnectionError) and len(e.args):
+        reason = getattr(e.args[0], 'reason', None)
+        return isinstance(reason, urllib3.exceptions.NewConnectionError)
+    return False
+
+
+# Converts an element tree to nested dicts, following the rules of
+# the StackOverflow recipe this used to be
+# (http://stackoverflow.com/questions/7684333/converting-xml-to-dictionary-using-elementtree):
+#
+#   - attributes become '@name' keys
+#   - children become keys named by tag; a tag seen once maps to
+#     its value, a tag seen more than once to a list of values
+#   - text is stripped; it becomes the value itself for a bare
+#     element, or a '#text' key if there are attributes or children
+#   - an element with none of these is None
+#
+# It walks the tree with an explicit stack, so there is no recursion
+# limit and no per-element temporary dicts. A converted value is never
+# a list, so a list in a parent's dict always means "repeated tag".
+def etreeToDict(t):
+    stack = [ (t, iter(t), {}) ]
+    value = None
+    while stack:
+        el, children, groups = stack[-1]
+        child = next(children, None)
+        if child is not None:
+            stack.append((child, iter(child), {}))
+            continue
+        stack.pop()
+
+        attrib = el.attrib
+        if groups:
+            value = groups
+        elif attrib:
+            value = {}
+        else:
+            value = None
+        if attrib:
+            for k, v in attrib.items():
+                value['@' + k] = v
+        text = el.text
+        if text:
+            text = text.strip()
+            if groups or attrib:
+                if text:
+                    value['#text'] = text
+            else:
+                value = text
+
+        if stack:
+            siblings = stack[-1][2]
+            tag = el.tag
+            if tag in siblings:
+                prev = siblings[tag]
+                if type(prev) is list:
+                    prev.append(value)
+                else:
+                    siblings[tag] = [ prev, value ]
+            else:
+                siblings[tag] = value
+
+    return {t.tag: value}
+
+
+# the converted value of a single element, without its tag
+def elementValue(el):
+    return etreeToDict(el)[el.tag]
+
+
+# Describes which parts of each feed entry a caller actually needs.
+# extract is called with each <entry> element (namespaces already
+# stripped) as soon as the parser has it, and returns what should
+# stand in for that entry; the rest of the entry is discarded without
+# ever being turned into dicts. Projected feeds always have a list
+# under 'entry' (absent if there were no entries), and are cached
+# separately from unprojected ones, under their name.
+class Projection:
+
+    def __init__(self, name, extract):
+        self.name = name
+        self.extract = extract
+
 
 class VerySimpleCachedFetcher:
 
     def __init__(self,args):
         self.d2xml = d2xml.d2xml()
         self.loaded = False
-        self.dirty = False
-        self.file_name = ''
-        self.cache = {}
-        self.file_name = args.get('cachefile','fetch_cache.json')
+        self.file_name = args.get('cachefile','fetch_cache.sqlite')
+        self.cache = fetch_cache.makeCacheStore(
+                         self.file_name,
+                         args.get('legacycachefile','fetch_cache.json'))
         self.config_file = args.get('credfile','cdl_config.json')
         with open(self.config_file,'r') as fh:
             self.config = json.load(fh)
+        self.session = self._makeSession()
+        self.ttls = [ (re.compile(pattern), float(seconds))
+                      for pattern, seconds in self.config.get('cache_ttls', DEFAULT_CACHE_TTLS) ]
+        self.default_ttl = float(self.config.get('cache_default_ttl', DEFAULT_CACHE_TTL))
+        self.max_entries = int(self.config.get('cache_max_entries', DEFAULT_CACHE_MAX_ENTRIES))
+        self.puts_since_size_check = 0
+        self.stats = {}
+        self.stats_lock = threading.Lock()
+        self.stream_parse = bool(self.config.get('stream_parse', True))
+        self.limiter = self._makeLimiter()
+        self.retry_attempts = int(self.config.get('retry_attempts', 4))
+        self.retry_base_delay = float(self.config.get('retry_base_delay', 0.5))
+        self.retry_max_delay = float(self.config.get('retry_max_delay', 30))
+        self.retry_budget = int(self.config.get('retry_budget', 200))
+
+    # one pooled, keep-alive session shared by every GET, POST and
+    # DELETE, so we pay for the TLS handshake and auth setup once per
+    # connection rather than once per request
+    def _makeSession(self):
+        pool_size = int(self.config.get('pool_size', 10))
+        session = requests.Session()
+        adapter = requests.adapters.HTTPAdapter(
+            pool_connections = pool_size,
+            pool_maxsize = pool_size,
+        )
+        session.mount('https://', adapter)
+        session.mount('http://', adapter)
+        session.auth = (self.config['user'], self.config['password'])
+        session.headers.update({
+            'Accept-Encoding': 'gzip, deflate',
+            'Connection': 'keep-alive',
+        })
+        return session
 
+    def _timeout(self):
+        return (float(self.config.get('connect_timeout', 10)),
+                float(self.config.get('read_timeout', 120)))
+
+    # the limit never goes above pool_size, since requests beyond the
+    # pool would each open and then throw away a connection of their own
+    def _makeLimiter(self):
+        pool_size = int(self.config.get('pool_size', 10))
+        maximum = min(int(self.config.get('concurrency_max', 32)), pool_size)
+        minimum = min(int(self.config.get('concurrency_min', 1)), maximum)
+        initial = min(int(self.config.get('concurrency_initial', 4)), maximum)
+        return work_pool.AdaptiveLimiter(
+            initial      = initial,
+            minimum      = minimum,
+            maximum      = maximum,
+            spike_factor = self.config.get('latency_spike_factor', 3.0),
+        )
+
+    # every request goes through here, so that the adaptive limiter
+    # sees all of them. Its latency is taken when the response headers
+    # arrive, which is when the server has done its work, but the slot
+    # is held until read, if given, is done with the body: a streamed
+    # response keeps its connection until then, and the limiter must
+    # count every connection in use. read's result is returned in
+    # place of the response.
+    def _request(self, method, complete_url, read = None, **kwargs):
+        self.limiter.acquire()
+        latency = None
+        throttled = False
+        retry_after = None
+        try:
+            start = time.monotonic()
+            r = self.session.request(method, complete_url,
+                                     timeout = self._timeout(), **kwargs)
+            latency = time.monotonic() - start
+            if r.status_code in (429, 503):
+                throttled = True
+                retry_after = parseRetryAfter(r.headers.get('Retry-After'))
+                if retry_after is not None:
+                    retry_after = min(retry_after, self.retry_max_delay)
+            return r if read is None else read(r)
+        finally:
+            self.limiter.release(latency, throttled, retry_after)
+
+    # _request with retries. GET and DELETE are retried on connection
+    # errors, timeouts and RETRY_STATUSES; a POST, which must not be
+    # applied twice, only when the connection was never made or the
+    # server answered 429/503. Waits grow exponentially with full
+    # jitter, and never undercut a Retry-After. The whole run shares
+    # retry_budget retries, so a server that is down costs a bounded
+    # amount of waiting rather than attempts times every request.
+    # read, if given, is applied to the response inside the retry loop
+    # so that a connection dropped mid-body is retried too; its result
+    # is returned instead of the response. If usable is given, any
+    # other status that is not worth retrying is a failure too, rather
+    # than an answer. Raises FetchError once the request cannot be
+    # completed.
+    def _send(self, method, complete_url, read = None, usable = None, **kwargs):
+        idempotent = method != 'POST'
+        statuses = RETRY_STATUSES if idempotent else RETRY_STATUSES_POST
+
+        # the answer, read while _request still holds the slot; None
+        # for a response that is not going to be used
+        def finish(r):
+            if r.status_code in statuses or (usable is not None and
+                                             not usable(r.status_code)):
+                r.close()
+                return r, None
+            return r, (r if read is None else read(r))
+
+        attempt = 0
+        while True:
+            attempt += 1
+            retry_after = None
+            try:
+                r, value = self._request(method, complete_url, finish, **kwargs)
+                if r.status_code not in statuses:
+                    if usable is not None and not usable(r.status_code):
+                        self._count('failed')
+                        raise FetchError(method, complete_url,
+                                         'HTTP ' + str(r.status_code), attempt)
+                    return value
+                reason = 'HTTP ' + str(r.status_code)
+                retry_after = parseRetryAfter(r.headers.get('Retry-After'))
+            except requests.exceptions.RequestException as e:
+                reason = repr(e)
+                if not (idempotent or neverSent(e)):
+                    self._count('failed')
+                    raise FetchError(method, complete_url, reason, attempt)
+
+            if attempt >= self.retry_attempts or not self._takeRetry():
+                self._count('failed')
+                raise FetchError(method, complete_url, reason, attempt)
+            self._count('retried')
+            delay = random.uniform(0, min(self.retry_max_delay,
+                                          self.retry_base_delay * 2 ** (attempt - 1)))
+            if retry_after is not None:
+                delay = max(delay, min(retry_after, self.retry_max_delay))
+            print('-warn- ' + reason + ' from ' + complete_url +
+                  ', retrying in {0:.1f}s'.format(delay))
+            time.sleep(delay)
+
+    def _takeRetry(self):
+        with self.stats_lock:
+            if self.retry_budget <= 0:
+                return False
+            self.retry_budget -= 1
+            return True
 
     def __del__(self):
         # this cannot work reliably because python is ridiculous
@@ -39,48 +335,112 @@ class VerySimpleCachedFetcher:
         self.save()
 
     def load(self):
-        try:
-            with open(self.file_name,'r') as fh:
-                self.cache = json.load(fh)
-                self.loaded = True
-                self.dirty = False
-        except Exception as e:
-            print("Exception loading from: " + self.file_name)
-            print(e)
-        
+        self.cache.load()
+        self.loaded = True
 
     def save(self):
-        if self.dirty:
-            try:
-                with open(self.file_name,'w') as fh:
-                    fh.write(json.dumps(self.cache))
-                    self.dirty = False
-            except Exception as e:
-                print("Exception saving to " + self.file_name)
-                print(e)
+        self.cache.save()
+
+    def _ttl(self,name):
+        for pattern, seconds in self.ttls:
+            if pattern.search(name):
+                return seconds
+        return self.default_ttl
+
+    def _count(self, what):
+        with self.stats_lock:
+            self.stats[what] = self.stats.get(what, 0) + 1
+
+    # returns (value, fresh, validators) for a cached entry; value is
+    # None if there is no entry at all
+    def _lookup(self,name):
+        entry = self.cache.get(name)
+        if entry is None:
+            return None, False, None
+        value, stored_at, validators = entry
+        fresh = time.time() - stored_at <= self._ttl(name)
+        return value, fresh, validators
 
     def _retrieve(self,name):
-        if name in self.cache:
-            return self.cache[name]
+        value, fresh, _ = self._lookup(name)
+        if value is not None and fresh:
+            self._count('hits')
+            return value
         return None
 
-    def _store(self,name,thing):
-        self.dirty = True
-        self.cache[name] = thing
+    def _store(self,name,thing,validators = None):
+        self.cache.put(name,thing,validators)
+        # counting entries is not free, so only check the cap now and then
+        self.puts_since_size_check += 1
+        if self.puts_since_size_check >= 100:
+            self.puts_since_size_check = 0
+            size = self.cache.size()
+            if size > self.max_entries:
+                self.cache.evict(size - int(self.max_entries * 0.9))
 
 
 
 
 
-    def fetch(self,url_rest, remove_namespace=True):
-        v = self._retrieve(url_rest)
-        if v is not None:
-            return v
-        v = self._fetch(url_rest, remove_namespace)
-        if v is not None:
-            self._store(url_rest,v)
+    # for callers that want to keep something they worked out from
+    # fetched data in the cache. It is subject to the TTL of whatever
+    # url family the key looks like.
+    def getCached(self, key):
+        return self._retrieve(key)
+
+    def putCached(self, key, value):
+        self._store(key, value)
+
+    def _cacheKey(self, url_rest, projection = None):
+        if projection is None:
+            return url_rest
+        return url_rest + '#' + projection.name
+
+    # a stale entry that came with an ETag or Last-Modified header is
+    # revalidated with a conditional GET rather than refetched; if the
+    # server says 304 the stored copy is used and its clock restarted.
+    # With a projection, only what it extracts from each entry is
+    # parsed, returned and cached. use_cache = False always goes to the
+    # server and leaves the cache alone.
+    def fetch(self,url_rest, remove_namespace=True, projection=None, use_cache=True):
+        key = self._cacheKey(url_rest, projection)
+        if use_cache:
+            old, fresh, validators = self._lookup(key)
+        else:
+            old, fresh, validators = None, False, None
+        if old is not None and fresh:
+            self._count('hits')
+            return old
+        if old is None:
+            validators = None
+
+        entry_fn = None
+        if projection is not None:
+            entry_fn = projection.extract
+        v, new_validators = self._fetch(url_rest, remove_namespace, validators, entry_fn)
+        if v is NOT_MODIFIED:
+            self._count('revalidated')
+            self.cache.restamp(key)
+            return old
+
+        self._count('misses')
+        if v is not None and use_cache:
+            self._store(key,v,new_validators)
         return v
 
+    def reportStats(self):
+        print('-info- cache: {0} hits, {1} revalidated (304), {2} misses'.format(
+              self.stats.get('hits', 0),
+              self.stats.get('revalidated', 0),
+              self.stats.get('misses', 0)))
+        print('-info- requests: {0} retried, {1} failed'.format(
+              self.stats.get('retried', 0),
+              self.stats.get('failed', 0)))
+        print('-info- concurrency: limit now {0}, peak limit {1}, peak in flight {2}'.format(
+              int(self.limiter.limit),
+              int(self.limiter.peak_limit),
+              self.limiter.peak_in_flight))
+
 
 
     def delete(self, url_rest):
@@ -89,84 +449,200 @@ class VerySimpleCachedFetcher:
         try:
             complete_url = self.config['url_base'] + url_rest
             print('DELETE of ' + complete_url)
-            r = requests.delete(complete_url, auth = (self.config['user'],self.config['password']))
+            r = self._send('DELETE', complete_url)
             return r.status_code
         except Exception as e:
+            print(e)
             return 'req_failed'
 
 
+    # raises FetchError if the post could not be made
     def post(self, url_rest, data, topname):
         xstring = "<?xml version='1.0' encoding='utf-8' ?>\n"
         xstring += self.d2xml.makeString(data,topname,'utf-8').decode('utf-8')
         headers = { 'Content-Type': 'text/xml' }
         remove_namespace = True
-        try:
-            complete_url = self.config['url_base'] + url_rest
-            print('POST to ' + complete_url)
-            # print(xstring)
-            r = requests.post(complete_url, data = xstring, headers = headers, auth = (self.config['user'],self.config['password']))
+        complete_url = self.config['url_base'] + url_rest
+        print('POST to ' + complete_url)
+        # print(xstring)
+
+        def read(r):
             try:
-                it = etree.iterparse(StringIO(r.text))
-                if remove_namespace:
-                    for _, el in it:
-                        if '}' in el.tag:
-                            el.tag = el.tag.split('}',1)[1]
-                root = it.root
-                return self.etree_to_dict(root)
+                return self._parseResponse(r, remove_namespace)
             except Exception as e:
                 print('Parse exception')
                 print(e)
-        except Exception as e:
-            print('Exception')
-            print(f)
+
+        return self._send('POST', complete_url, read, data = xstring, headers = headers,
+                          stream = self.stream_parse)
 
 
     # fetches from the CDL and returns the result as a dictionary
-    # (not as XML) with namespace stuff removed (for convenience)
-    def _fetch(self,url_rest, remove_namespace=True):
-        try:
-            complete_url = self.config['url_base'] + url_rest
-            print('GET from ' + complete_url)
-            r = requests.get(complete_url, auth = (self.config['user'],self.config['password']))
+    # (not as XML) with namespace stuff removed (for convenience),
+    # along with the response's cache validators. If validators are
+    # given they are sent as If-None-Match / If-Modified-Since, and
+    # NOT_MODIFIED is returned if the server answers 304. A body that
+    # cannot be parsed gives (None, None); a request that cannot be
+    # completed, or is answered with an error other than 404, raises
+    # FetchError.
+    def _fetch(self,url_rest, remove_namespace=True, validators=None, entry_fn=None):
+        complete_url = self.config['url_base'] + url_rest
+        print('GET from ' + complete_url)
+        headers = {}
+        if validators:
+            if validators.get('etag'):
+                headers['If-None-Match'] = validators['etag']
+            if validators.get('last_modified'):
+                headers['If-Modified-Since'] = validators['last_modified']
+
+        def usable(status):
+            return (200 <= status < 300 or status == 404 or
+                    (status == 304 and bool(validators)))
+
+        def read(r):
+            if r.status_code == 304 and validators:
+                # reading the (empty) body to the end hands the
+                # connection back to the pool; closing it unread
+                # would throw the connection away
+                r.content
+                r.close()
+                return NOT_MODIFIED, validators
+
+            new_validators = {
+                'etag': r.headers.get('ETag'),
+                'last_modified': r.headers.get('Last-Modified'),
+            }
 
             try:
-                it = etree.iterparse(StringIO(r.text))
-                if remove_namespace:
-                    for _, el in it:
-                        if '}' in el.tag:
-                            el.tag = el.tag.split('}',1)[1]
-                root = it.root
-                return self.etree_to_dict(root)
-                
+                return self._parseResponse(r, remove_namespace, entry_fn), new_validators
+            except requests.exceptions.RequestException as e:
+                # the connection went while the body was arriving
+                raise
             except Exception as e:
                 print('Parse Exception')
                 print(e)
-        except Exception as f:
-            print('Exception')
-            print(f)
+            return None, None
 
-        return None
+        return self._send('GET', complete_url, read, usable, headers = headers,
+                          stream = self.stream_parse)
 
 
-    
-    ## Stolen from 
-    ## http://stackoverflow.com/questions/7684333/converting-xml-to-dictionary-using-elementtree
-    def etree_to_dict(self,t):
-        d = {t.tag: {} if t.attrib else None}
-        children = list(t)
-        if children:
-            dd = defaultdict(list)
-            for dc in map(self.etree_to_dict, children):
-                for k, v in dc.items():
-                    dd[k].append(v)
-            d = {t.tag: {k:v[0] if len(v) == 1 else v for k, v in dd.items()}}
-        if t.attrib:
-            d[t.tag].update(('@' + k, v) for k, v in t.attrib.items())
-        if t.text:
-            text = t.text.strip()
-            if children or t.attrib:
-                if text:
-                  d[t.tag]['#text'] = text
+    def _parseResponse(self, r, remove_namespace=True, entry_fn=None):
+        if self.stream_parse:
+            try:
+                return self._parseStream(r.iter_content(chunk_size = 64 * 1024),
+                                         remove_namespace, entry_fn)
+            finally:
+                r.close()
+
+        if entry_fn is not None:
+            return self._parseStream([ r.content ], remove_namespace, entry_fn)
+
+        it = etree.iterparse(StringIO(r.text))
+        if remove_namespace:
+            for _, el in it:
+                if '}' in el.tag:
+                    el.tag = el.tag.split('}',1)[1]
+        root = it.root
+        return self.etree_to_dict(root)
+
+    # parses a document as its bytes arrive, rather than after the whole
+    # body has been read. Namespaces are stripped as each element opens,
+    # and each top-level <entry> is handed to entry_fn (by default,
+    # converted to a dict) the moment it closes and is then dropped from
+    # the tree, so only one entry's worth of elements is ever held at
+    # once. Without an entry_fn the result is the same dict
+    # etree_to_dict would have made of the whole document; with one,
+    # 'entry' is always a list of whatever it returned.
+    def _parseStream(self, chunks, remove_namespace=True, entry_fn=None):
+        collapse = entry_fn is None
+        if entry_fn is None:
+            entry_fn = elementValue
+        parser = etree.XMLPullParser(events = ('start', 'end'))
+        open_elems = []
+        entries = []
+        root = None
+
+        def handle(events):
+            nonlocal root
+            for event, el in events:
+                if event == 'start':
+                    if remove_namespace and '}' in el.tag:
+                        el.tag = el.tag.split('}',1)[1]
+                    if root is None:
+                        root = el
+                    open_elems.append(el)
+                else:
+                    open_elems.pop()
+                    if el.tag == 'entry' and len(open_elems) == 1:
+                        entries.append(entry_fn(el))
+                        open_elems[0].remove(el)
+
+        for chunk in chunks:
+            parser.feed(chunk)
+            handle(parser.read_events())
+        parser.close()
+        handle(parser.read_events())
+
+        d = self.etree_to_dict(root)
+        if len(entries):
+            top = d[root.tag]
+            if not isinstance(top, dict):
+                # the entries were the root's only children
+                top = { '#text': top } if top else {}
+                d[root.tag] = top
+            if collapse and len(entries) == 1:
+                top['entry'] = entries[0]
             else:
-                d[t.tag] = text
+                top['entry'] = entries
         return d
+
+
+    
+    def etree_to_dict(self,t):
+        return etreeToDict(t)
+
+
+
+# awaitable front end to a VerySimpleCachedFetcher. Cache hits are
+# answered straight from the wrapped fetcher's cache; misses, posts and
+# deletes are run on a thread pool sharing the fetcher's pooled
+# session, with at most max_in_flight of them outstanding at once.
+# Results have exactly the same shape as the synchronous calls.
+class AsyncCachedFetcher:
+
+    def __init__(self, fetcher, max_in_flight = None):
+        self.fetcher = fetcher
+        if max_in_flight is None:
+            max_in_flight = fetcher.config.get('max_in_flight', 100)
+        self.max_in_flight = int(max_in_flight)
+        self.executor = concurrent.futures.ThreadPoolExecutor(
+                            max_workers = self.max_in_flight)
+        self.semaphores = {}
+
+    # a semaphore belongs to the event loop it was made in, so keep
+    # one per loop in case the caller runs more than one
+    def _semaphore(self):
+        loop = asyncio.get_running_loop()
+        sem = self.semaphores.get(loop)
+        if sem is None:
+            sem = asyncio.Semaphore(self.max_in_flight)
+            self.semaphores[loop] = sem
+        return sem
+
+    async def _run(self, fn, *args):
+        async with self._semaphore():
+            loop = asyncio.get_running_loop()
+            return await loop.run_in_executor(self.executor, fn, *args)
+
+    async def fetch(self, url_rest, remove_namespace=True, projection=None):
+        v = self.fetcher._retrieve(self.fetcher._cacheKey(url_rest, projection))
+        if v is not None:
+            return v
+        return await self._run(self.fetcher.fetch, url_rest, remove_namespace, projection)
+
+    async def post(self, url_rest, data, topname):
+        return await self._run(self.fetcher.post, url_rest, data, topname)
+
+    async def delete(self, url_rest):
+        return await self._run(self.fetcher.delete, url_rest)
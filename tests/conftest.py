@@ -0,0 +1,46 @@
+# the tools are plain modules at the top of the repository, and the
+# tests import them (and the mock server next to this file) directly
+import os
+import sys
+
+here = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, here)
+sys.path.insert(0, os.path.dirname(here))
+
+import pytest
+
+import sympl_api_highlevel
+import sympl_api_lowlevel
+from mock_elements import MockElements
+
+
+# a mock Elements server, shut down after the test
+@pytest.fixture
+def mock():
+    m = MockElements()
+    yield m
+    m.close()
+
+
+# the args a fetcher or API is made with: a credentials file pointing
+# at mock, with any other settings given, and every file it keeps in
+# dir_name, so that each one made in its own directory starts cold
+def makeArgs(mock, dir_name, **settings):
+    dir_name.mkdir(parents = True, exist_ok = True)
+    return {
+        'credfile': mock.writeConfig(dir_name, **settings),
+        'cachefile': str(dir_name / 'fetch_cache.sqlite'),
+        'legacycachefile': str(dir_name / 'fetch_cache.json'),
+        'grantfile': str(dir_name / 'grant_snapshot.json'),
+    }
+
+
+def makeFetcher(mock, dir_name, **settings):
+    fetcher = sympl_api_lowlevel.VerySimpleCachedFetcher(
+                  makeArgs(mock, dir_name, **settings))
+    fetcher.load()
+    return fetcher
+
+
+def makeAPI(mock, dir_name, **settings):
+    return sympl_api_highlevel.SymplecticAPI(makeArgs(mock, dir_name, **settings))
@@ -0,0 +1,148 @@
+#!/usr/local/bin/python3
+
+# ****
+# Lawrence Berkeley National Lab
+#
+# A stand-in for the Elements API, for the tests, built on the
+# standard library's http.server. It serves whatever documents have
+# been put in it, keyed by the url after /api/ (query string and all),
+# and answers 404 for anything else. Every document goes out with an
+# ETag and a Last-Modified header, and a request whose If-None-Match
+# or If-Modified-Since still matches gets a 304 with no body. Each
+# answer can be held back by delay seconds, and its body by a further
+# body_delay after the headers have gone, and the most requests the
+# server was ever working on at once is kept in peak_in_flight.
+# ****
+
+import email.utils
+import hashlib
+import http.server
+import json
+import os
+import threading
+import time
+
+NOT_FOUND = b'<?xml version="1.0" encoding="utf-8"?><error>not found</error>'
+
+
+class MockElements:
+
+    def __init__(self):
+        self.documents = {}
+        self.modified = {}
+        # with etags off, only Last-Modified is sent
+        self.etags = True
+        # the status of every GET answered, in order
+        self.statuses = []
+        self.connections = 0
+        self.delay = 0
+        self.body_delay = 0
+        self.in_flight = 0
+        self.peak_in_flight = 0
+        self.lock = threading.Lock()
+        self.server = http.server.ThreadingHTTPServer(('127.0.0.1', 0),
+                                                      self._handlerClass())
+        self.thread = threading.Thread(target = self.server.serve_forever,
+                                       daemon = True)
+        self.thread.start()
+
+    def urlBase(self):
+        return 'http://127.0.0.1:{0}/api/'.format(self.server.server_port)
+
+    # puts a document (a str or bytes) at path, or replaces the one
+    # there, which counts as a change for Last-Modified
+    def put(self, path, body):
+        if isinstance(body, str):
+            body = body.encode('utf-8')
+        with self.lock:
+            self.documents[path] = body
+            self.modified[path] = int(time.time())
+
+    # writes a credentials file pointing at this server, with any
+    # other settings given, and returns its name
+    def writeConfig(self, dir_name, **settings):
+        config = { 'user': 'user', 'password': 'password',
+                   'url_base': self.urlBase() }
+        config.update(settings)
+        file_name = os.path.join(str(dir_name), 'cdl_config.json')
+        with open(file_name, 'w') as fh:
+            json.dump(config, fh)
+        return file_name
+
+    def close(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+    def _answer(self, handler):
+        with self.lock:
+            self.in_flight += 1
+            self.peak_in_flight = max(self.peak_in_flight, self.in_flight)
+        try:
+            time.sleep(self.delay)
+            self._reply(handler)
+        finally:
+            with self.lock:
+                self.in_flight -= 1
+
+    def _reply(self, handler):
+        path = handler.path.split('/api/', 1)[-1]
+        with self.lock:
+            body = self.documents.get(path)
+            modified = self.modified.get(path)
+
+        headers = {}
+        if body is None:
+            status, body = 404, NOT_FOUND
+        else:
+            status = 200
+            etag = '"' + hashlib.sha1(body).hexdigest() + '"'
+            headers['Last-Modified'] = email.utils.formatdate(modified, usegmt = True)
+            if self.etags:
+                headers['ETag'] = etag
+            # If-None-Match wins when both are sent
+            inm = handler.headers.get('If-None-Match')
+            ims = handler.headers.get('If-Modified-Since')
+            if inm is not None and self.etags:
+                if inm == etag:
+                    status = 304
+            elif ims is not None:
+                try:
+                    since = email.utils.parsedate_to_datetime(ims).timestamp()
+                except (TypeError, ValueError):
+                    since = None
+                if since is not None and modified <= since:
+                    status = 304
+            if status == 304:
+                body = b''
+
+        with self.lock:
+            self.statuses.append(status)
+        handler.send_response(status)
+        handler.send_header('Content-Type', 'text/xml')
+        for k, v in headers.items():
+            handler.send_header(k, v)
+        handler.send_header('Content-Length', str(len(body)))
+        handler.end_headers()
+        if len(body):
+            time.sleep(self.body_delay)
+        handler.wfile.write(body)
+
+    def _handlerClass(self):
+        mock = self
+
+        class Handler(http.server.BaseHTTPRequestHandler):
+            protocol_version = 'HTTP/1.1'
+
+            # one handler per connection, since they are kept alive
+            def setup(self):
+                super().setup()
+                with mock.lock:
+                    mock.connections += 1
+
+            def do_GET(self):
+                mock._answer(self)
+
+            def log_message(self, *args):
+                pass
+
+        return Handler
@@ -0,0 +1,116 @@
+# the awaitable lookups against the mock server: they must give exactly
+# what the plain ones give, and the async fetcher's semaphore must keep
+# the number of requests in flight within max_in_flight
+
+import asyncio
+
+import sympl_api_lowlevel
+from conftest import makeAPI, makeFetcher
+
+FEED = '''<?xml version="1.0" encoding="utf-8"?>
+<feed xmlns="http://www.w3.org/2005/Atom"
+      xmlns:api="http://www.symplectic.co.uk/publications/api">
+  <api:pagination results-count="{count}" items-per-page="2">
+    <api:page position="first" number="1"/>
+    <api:page position="this" number="{page}"/>
+    <api:page position="last" number="{last}"/>
+  </api:pagination>
+  {entries}
+</feed>'''
+
+USER = '<entry><api:object category="user" id="{0}" username="{1}"/></entry>'
+
+PUB = '''<entry>
+  <title>Pub {0}</title>
+  <api:object category="publication" id="{0}" type="journal-article">
+    <api:records><api:record source-name="manual" format="native"><api:native>
+      <api:field name="title" type="text"><api:text>Pub {0}</api:text></api:field>
+      <api:field name="doi" type="text"><api:text>10.1000/p{0}</api:text></api:field>
+    </api:native></api:record></api:records>
+  </api:object>
+</entry>'''
+
+RELATIONSHIP = '''<entry>
+  <api:relationship id="{0}" type-id="8" type="publication-user-authorship">
+    <api:related direction="to" id="{1}"/>
+  </api:relationship>
+</entry>'''
+
+EMAILS = [ 'user{0}@lbl.gov'.format(i) for i in range(6) ] + [ 'nobody@lbl.gov' ]
+PUBIDS = [ 1001, 1002, 1003 ]
+QUERY = '"10.1000"'
+
+
+def feed(entries, page = 1, last = 1):
+    return FEED.format(count = len(entries), page = page, last = last,
+                       entries = '\n'.join(entries))
+
+
+# users, three pages of search results, and details and relationships
+# for a few pubs
+def populate(mock, api):
+    for i, email in enumerate(EMAILS):
+        entries = [] if email.startswith('nobody') else [ USER.format(100 + i, email) ]
+        mock.put(api._userIDURL(email), feed(entries))
+    pubs = [ PUB.format(i) for i in range(1001, 1006) ]
+    for page in range(1, 4):
+        mock.put(api._pubsQueryURL(QUERY, page),
+                 feed(pubs[(page - 1) * 2:page * 2], page, 3))
+    for pubid in PUBIDS:
+        mock.put('publications/' + str(pubid), feed([ PUB.format(pubid) ]))
+        mock.put('publications/' + str(pubid) + '/relationships',
+                 feed([ RELATIONSHIP.format(pubid * 10, 555) ]))
+
+
+# the sync and async runs each have a cache of their own, so that
+# both go to the server
+def test_async_lookups_match_sync(mock, tmp_path):
+    sync_api = makeAPI(mock, tmp_path / 'sync')
+    async_api = makeAPI(mock, tmp_path / 'async')
+    populate(mock, sync_api)
+
+    expected = {
+        'users': [ sync_api.obtainUserID(email) for email in EMAILS ],
+        'pubs':  sync_api.getListOfPubsQuery(QUERY),
+        'details': [ sync_api.getPubDetails(pubid) for pubid in PUBIDS ],
+        'relationships': [ sync_api.getPubRelationships(pubid) for pubid in PUBIDS ],
+    }
+
+    async def lookUp(api):
+        users = asyncio.gather(*[ api.obtainUserIDAsync(email) for email in EMAILS ])
+        pubs = api.getListOfPubsQueryAsync(QUERY)
+        details = asyncio.gather(*[ api.getPubDetailsAsync(pubid) for pubid in PUBIDS ])
+        relationships = asyncio.gather(*[ api.getPubRelationshipsAsync(pubid)
+                                          for pubid in PUBIDS ])
+        results = await asyncio.gather(users, pubs, details, relationships)
+        return dict(zip([ 'users', 'pubs', 'details', 'relationships' ], results))
+
+    statuses = len(mock.statuses)
+    got = asyncio.run(lookUp(async_api))
+    assert len(mock.statuses) > statuses
+    assert got == expected
+    assert got['users'][0] == '100'
+    assert got['users'][-1] is None
+    assert sorted(got['pubs']) == [ str(i) for i in range(1001, 1006) ]
+
+
+def test_semaphore_bounds_requests_in_flight(mock, tmp_path):
+    # the limiter and pool allow far more than the semaphore, so the
+    # semaphore is what holds requests back
+    fetcher = makeFetcher(mock, tmp_path, pool_size = 16, concurrency_initial = 16,
+                          concurrency_max = 16)
+    afetcher = sympl_api_lowlevel.AsyncCachedFetcher(fetcher, max_in_flight = 3)
+
+    for i in range(12):
+        mock.put('users/' + str(i), feed([ USER.format(i, 'someone') ]))
+    mock.delay = 0.05
+
+    async def fetchAll():
+        return await asyncio.gather(*[ afetcher.fetch('users/' + str(i))
+                                       for i in range(12) ])
+
+    results = asyncio.run(fetchAll())
+    assert [ r['feed']['entry']['object']['@id'] for r in results ] == \
+           [ str(i) for i in range(12) ]
+    assert mock.statuses == [ 200 ] * 12
+    assert mock.peak_in_flight == 3
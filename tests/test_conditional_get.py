@@ -0,0 +1,73 @@
+# the fetch cache against a server that honours If-None-Match and
+# If-Modified-Since: fresh entries are hits, stale ones are revalidated
+# with a conditional GET, and changed documents are fetched again
+
+import conftest
+
+USER = '''<?xml version="1.0" encoding="utf-8"?>
+<feed xmlns="http://www.w3.org/2005/Atom"
+      xmlns:api="http://www.symplectic.co.uk/publications/api">
+  <entry><api:object category="user" id="{0}" username="someone"/></entry>
+</feed>'''
+
+
+# ttl is how long every entry stays fresh; 0 makes each fetch after
+# the first a revalidation
+def makeFetcher(mock, tmp_path, ttl = 3600, **settings):
+    return conftest.makeFetcher(mock, tmp_path, cache_ttls = [],
+                                cache_default_ttl = ttl, **settings)
+
+
+def userID(data):
+    return data['feed']['entry']['object']['@id']
+
+
+def test_fresh_entry_is_a_hit(mock, tmp_path):
+    mock.put('users/1', USER.format(1))
+    fetcher = makeFetcher(mock, tmp_path)
+    assert userID(fetcher.fetch('users/1')) == '1'
+    assert userID(fetcher.fetch('users/1')) == '1'
+    assert mock.statuses == [ 200 ]
+    assert fetcher.stats.get('hits') == 1
+    assert fetcher.stats.get('misses') == 1
+
+
+def test_stale_entry_is_revalidated(mock, tmp_path):
+    mock.put('users/1', USER.format(1))
+    fetcher = makeFetcher(mock, tmp_path, ttl = 0)
+    first = fetcher.fetch('users/1')
+    assert fetcher.fetch('users/1') == first
+    assert mock.statuses == [ 200, 304 ]
+    assert fetcher.stats.get('revalidated') == 1
+    assert fetcher.stats.get('misses') == 1
+
+
+def test_stale_entry_is_revalidated_by_date(mock, tmp_path):
+    mock.etags = False
+    mock.put('users/1', USER.format(1))
+    fetcher = makeFetcher(mock, tmp_path, ttl = 0)
+    first = fetcher.fetch('users/1')
+    assert fetcher.fetch('users/1') == first
+    assert mock.statuses == [ 200, 304 ]
+
+
+def test_changed_document_is_a_miss(mock, tmp_path):
+    mock.put('users/1', USER.format(1))
+    fetcher = makeFetcher(mock, tmp_path, ttl = 0)
+    assert userID(fetcher.fetch('users/1')) == '1'
+    mock.put('users/1', USER.format(2))
+    assert userID(fetcher.fetch('users/1')) == '2'
+    assert mock.statuses == [ 200, 200 ]
+    assert fetcher.stats.get('misses') == 2
+    # and the new copy is what is revalidated from then on
+    assert userID(fetcher.fetch('users/1')) == '2'
+    assert mock.statuses == [ 200, 200, 304 ]
+
+
+def test_not_modified_gives_back_its_connection(mock, tmp_path):
+    mock.put('users/1', USER.format(1))
+    fetcher = makeFetcher(mock, tmp_path, ttl = 0, pool_size = 1)
+    for i in range(5):
+        fetcher.fetch('users/1')
+    assert mock.statuses == [ 200, 304, 304, 304, 304 ]
+    assert mock.connections == 1
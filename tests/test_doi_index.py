@@ -0,0 +1,58 @@
+# the DOI index's sqlite file when a rebuild is interrupted: the old
+# index must be left whole, not its sources without its pubs table
+
+import pytest
+
+import csvloader
+import doi_index
+
+
+def writeExport(path, rows):
+    with open(str(path), 'w') as fh:
+        fh.write('system_id\tdoi\ttitle\ttype\n')
+        for sid, doi in rows:
+            fh.write('{0}\t{1}\tPub {0}\tjournal-article\n'.format(sid, doi))
+
+
+def test_interrupted_rebuild_keeps_old_index(tmp_path, monkeypatch):
+    a = tmp_path / 'a.tsv'
+    b = tmp_path / 'b.tsv'
+    db = str(tmp_path / 'doi_index.sqlite')
+    writeExport(a, [ ('1001', '10.1000/P1') ])
+    writeExport(b, [ ('1002', '10.1000/p2') ])
+    doi_index.DOIIndex(db, [ str(a), str(b) ]).close()
+
+    # b changes, and the rebuild that follows stops part way through
+    writeExport(b, [ ('1002', '10.1000/p2'), ('1003', '10.1000/p3') ])
+    iterLoad = csvloader.iterLoad
+
+    def interrupted(path, dialect = None):
+        if path == str(b):
+            raise KeyboardInterrupt()
+        return iterLoad(path, dialect)
+
+    monkeypatch.setattr(csvloader, 'iterLoad', interrupted)
+    with pytest.raises(KeyboardInterrupt):
+        doi_index.DOIIndex(db, [ str(a), str(b) ])
+    monkeypatch.undo()
+
+    # with b gone, whatever was indexed before is used
+    b.unlink()
+    index = doi_index.DOIIndex(db, [ str(a), str(b) ])
+    assert index.systemID('10.1000/p1') == '1001'
+    assert index.systemID('10.1000/p2') == '1002'
+    assert index.doi('1002') == '10.1000/p2'
+    index.close()
+
+
+def test_missing_pubs_table_is_rebuilt(tmp_path):
+    a = tmp_path / 'a.tsv'
+    db = str(tmp_path / 'doi_index.sqlite')
+    writeExport(a, [ ('1001', '10.1000/p1') ])
+    index = doi_index.DOIIndex(db, [ str(a) ])
+    index.db.execute('DROP TABLE pubs')
+    index.close()
+
+    index = doi_index.DOIIndex(db, [ str(a) ])
+    assert index.systemID('10.1000/p1') == '1001'
+    index.close()
@@ -0,0 +1,63 @@
+# grant lookups when a captured field is empty (<api:text/>, which
+# comes back as None), both from a fresh fetch and from the snapshot
+
+import json
+import urllib.parse
+
+import pytest
+
+from conftest import makeAPI
+
+GRANTS = '''<?xml version="1.0" encoding="utf-8"?>
+<feed xmlns="http://www.w3.org/2005/Atom"
+      xmlns:api="http://www.symplectic.co.uk/publications/api">
+  <title>Grants</title>
+  {0}
+</feed>'''
+
+GRANT = '''<entry>
+  <api:object category="grant" id="{0}" type="x">
+    <api:records><api:record source-name="source-3" format="native"><api:native>
+      <api:field name="funder-name" type="text"><api:text>{1}</api:text></api:field>
+      <api:field name="funder-reference" type="text">{2}</api:field>
+    </api:native></api:record></api:records>
+  </api:object>
+</entry>'''
+
+
+@pytest.fixture
+def grants(mock):
+    mock.put('grants?detail=full&per-page=25&page=1', GRANTS.format('\n'.join([
+        GRANT.format(1, 'Office of Science', '<api:text>DE-AC02-05CH11231</api:text>'),
+        GRANT.format(2, 'Office of Science', '<api:text/>'),
+        GRANT.format(3, 'NSF', '<api:text>NSF-1234567</api:text>'),
+    ])))
+    return mock
+
+
+def checkLookups(api):
+    assert api.findGrantsMatching('DE-AC02-05CH11231', 'funder-reference') == [ '1' ]
+    assert api.findGrantsMatching('', 'funder-reference') == [ '2' ]
+    assert api.findGrantsMatching('None', 'funder-reference') == []
+    assert api.findGrantsMatching('[0-9]{7}', 'funder-reference', False) == [ '3' ]
+    assert api.findGrantsMatching('^$', 'funder-reference', False) == [ '2' ]
+
+
+def test_empty_field_after_fetch(grants, tmp_path):
+    api = makeAPI(grants, tmp_path)
+    checkLookups(api)
+    assert api.grantData['2']['funder-reference'] is None
+
+
+def test_empty_field_after_snapshot(grants, tmp_path):
+    makeAPI(grants, tmp_path).loadGrantData()
+    # nothing has changed since, so the saved index is used as it is
+    with open(str(tmp_path / 'grant_snapshot.json')) as fh:
+        synced_at = json.load(fh)['synced_at']
+    grants.put('grants?' + urllib.parse.urlencode({
+                 'detail': 'full', 'per-page': 25, 'page': 1,
+                 'modified-since': synced_at }),
+             GRANTS.format(''))
+    api = makeAPI(grants, tmp_path)
+    checkLookups(api)
+    assert 'null' not in api.grantIndex['funder-reference']
@@ -0,0 +1,28 @@
+# the adaptive limiter against the mock server: a request keeps its
+# slot while its body is being read, so no more connections are ever
+# open than the pool keeps
+
+import concurrent.futures
+
+from conftest import makeFetcher
+
+USER = '''<?xml version="1.0" encoding="utf-8"?>
+<feed xmlns="http://www.w3.org/2005/Atom"
+      xmlns:api="http://www.symplectic.co.uk/publications/api">
+  <entry><api:object category="user" id="{0}" username="someone"/></entry>
+</feed>'''
+
+
+def test_slow_bodies_stay_within_the_pool(mock, tmp_path):
+    fetcher = makeFetcher(mock, tmp_path, pool_size = 2, concurrency_initial = 2)
+    for i in range(8):
+        mock.put('users/' + str(i), USER.format(i))
+    mock.body_delay = 0.1
+
+    with concurrent.futures.ThreadPoolExecutor(max_workers = 8) as ex:
+        results = list(ex.map(lambda i: fetcher.fetch('users/' + str(i)), range(8)))
+
+    assert [ r['feed']['entry']['object']['@id'] for r in results ] == \
+           [ str(i) for i in range(8) ]
+    assert mock.peak_in_flight <= 2
+    assert mock.connections <= 2
@@ -0,0 +1,41 @@
+# resolveDOIs when the batched search does not come back as a feed:
+# its DOIs must still be settled by the one-at-a-time searches
+
+import pytest
+
+from conftest import makeAPI
+
+FEED = '''<?xml version="1.0" encoding="utf-8"?>
+<feed xmlns="http://www.w3.org/2005/Atom"
+      xmlns:api="http://www.symplectic.co.uk/publications/api">
+  <title>Search</title>
+  {0}
+</feed>'''
+
+PUB = '''<entry>
+  <title>Pub {0}</title>
+  <api:object category="publication" id="{0}" type="journal-article"/>
+</entry>'''
+
+DOIS = [ '10.1000/p1', '10.1000/p2' ]
+
+BAD_BATCHES = {
+    'not found': None,
+    'unparseable': '<feed><entry>',
+    'empty feed': '<feed xmlns="http://www.w3.org/2005/Atom"/>',
+}
+
+
+@pytest.mark.parametrize('batch', list(BAD_BATCHES))
+def test_bad_batch_falls_back_to_single_searches(mock, tmp_path, batch):
+    api = makeAPI(mock, tmp_path)
+    if BAD_BATCHES[batch] is not None:
+        q = ' OR '.join([ '"' + doi + '"' for doi in DOIS ])
+        mock.put(api._pubsQueryURL(q, 1, 'full'), BAD_BATCHES[batch])
+    for n, doi in enumerate(DOIS):
+        mock.put(api._pubsQueryURL('"' + doi + '"', 1), FEED.format(PUB.format(1001 + n)))
+
+    assert api.resolveDOIs(DOIS) == {
+        '10.1000/p1': { '1001': { 'type': 'journal-article', 'title': 'Pub 1001' } },
+        '10.1000/p2': { '1002': { 'type': 'journal-article', 'title': 'Pub 1002' } },
+    }
@@ -0,0 +1,116 @@
+#!/usr/local/bin/python3
+
+# ****
+# Lawrence Berkeley National Lab
+#
+# Small helpers for running many API requests at once without
+# overrunning the Elements server's throttling.
+# ****
+
+import threading
+import time
+import concurrent.futures
+
+
+# Classic token bucket: tokens drip in at rate per second up to burst,
+# and each take() uses one, waiting for it if necessary. A rate of 0
+# or less means no limit.
+class TokenBucket:
+
+    def __init__(self, rate, burst = None):
+        self.rate = float(rate)
+        if burst is None:
+            burst = max(1.0, self.rate)
+        self.burst = float(burst)
+        self.tokens = self.burst
+        self.last = time.monotonic()
+        self.lock = threading.Lock()
+
+    def take(self):
+        if self.rate <= 0:
+            return
+        while True:
+            with self.lock:
+                now = time.monotonic()
+                self.tokens = min(self.burst, self.tokens + (now - self.last) * self.rate)
+                self.last = now
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    return
+                wait = (1 - self.tokens) / self.rate
+            time.sleep(wait)
+
+
+# Calls fn(item) for every item on a pool of workers threads, taking a
+# token from bucket (if given) before each call. Returns the results
+# in the same order as items, whatever order the calls finish in.
+def runOrdered(fn, items, workers, bucket = None):
+    def call(item):
+        if bucket is not None:
+            bucket.take()
+        return fn(item)
+
+    with concurrent.futures.ThreadPoolExecutor(max_workers = max(1, workers)) as ex:
+        return list(ex.map(call, items))
+
+
+# A concurrency limit that adjusts itself (AIMD). While requests come
+# back promptly the limit creeps up by about one per limit's worth of
+# successes; when the server pushes back (429/503) or a response takes
+# far longer than usual (spike_factor times the running average, and
+# at least spike_floor seconds), it is halved, at most once a second so a
+# single burst of bad answers does not flatten it. A Retry-After from
+# the server holds off every new request until it has passed.
+class AdaptiveLimiter:
+
+    def __init__(self, initial = 4, minimum = 1, maximum = 32,
+                 spike_factor = 3.0, spike_floor = 0.5):
+        self.minimum = float(minimum)
+        self.maximum = float(maximum)
+        self.limit = min(self.maximum, max(self.minimum, float(initial)))
+        self.spike_factor = float(spike_factor)
+        self.spike_floor = float(spike_floor)
+        self.in_flight = 0
+        self.peak_limit = self.limit
+        self.peak_in_flight = 0
+        self.typical_latency = None
+        self.last_decrease = 0.0
+        self.paused_until = 0.0
+        self.cond = threading.Condition()
+
+    def acquire(self):
+        with self.cond:
+            while True:
+                now = time.monotonic()
+                if now < self.paused_until:
+                    self.cond.wait(self.paused_until - now)
+                elif self.in_flight < int(self.limit):
+                    break
+                else:
+                    self.cond.wait()
+            self.in_flight += 1
+            self.peak_in_flight = max(self.peak_in_flight, self.in_flight)
+
+    # latency is None if the request never got an answer
+    def release(self, latency = None, throttled = False, retry_after = None):
+        with self.cond:
+            self.in_flight -= 1
+            now = time.monotonic()
+            if retry_after:
+                self.paused_until = max(self.paused_until, now + retry_after)
+
+            spike = (latency is not None and self.typical_latency is not None and
+                     latency > max(self.spike_floor,
+                                   self.spike_factor * self.typical_latency))
+            if throttled or spike:
+                if now - self.last_decrease >= 1.0:
+                    self.limit = max(self.minimum, self.limit / 2)
+                    self.last_decrease = now
+            elif latency is not None:
+                self.limit = min(self.maximum, self.limit + 1 / self.limit)
+                self.peak_limit = max(self.peak_limit, self.limit)
+                if self.typical_latency is None:
+                    self.typical_latency = latency
+                else:
+                    self.typical_latency = 0.9 * self.typical_latency + 0.1 * latency
+            self.cond.notify_all()